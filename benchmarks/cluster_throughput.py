@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Command throughput as the number of workers grows.
+
+For each worker count, starts a ``MessageHub`` and that many ``server.py``
+workers on localhost, connects simulated phones spread across the workers,
+then posts ``/api/command`` to the workers round-robin so most commands have
+to be routed to another worker. Each phone answers every command with a
+``message_response``. Reports delivered commands per second.
+
+Workers only add throughput when they get cores of their own: the simulated
+phones, the HTTP client and the hub run on the same machine, so with fewer
+cores than workers + 1 the extra workers just split the same CPU and every
+cross-worker command pays for the hub hop.
+
+    python benchmarks/cluster_throughput.py [--workers 1,2,4] [--phones 200] [--commands 4000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import aiohttp
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from cluster import MessageHub
+
+
+async def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+async def phone(port, phone_id, registered, received, stop):
+    async with websockets.connect(f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket",
+                                  ping_interval=None, max_queue=None) as ws:
+        await ws.recv()
+        await ws.send('40')
+        await ws.recv()
+        await ws.send('42' + json.dumps(['register', {'device_id': phone_id}]))
+        registered.set_result(True)
+        while not stop.is_set():
+            try:
+                packet = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if packet == '2':
+                await ws.send('3')
+            elif packet.startswith('42["command"'):
+                received[0] += 1
+                # Answer so the worker frees the in-flight slot for the next command
+                command = json.loads(packet[2:])[1]
+                await ws.send('42' + json.dumps(['message_response', {
+                    'phone_id': phone_id, 'type': 'shell', 'message': '',
+                    'correlation_id': command.get('correlation_id')}]))
+
+
+async def measure(ports, phones, commands, concurrency):
+    stop = asyncio.Event()
+    received = [0]
+    tasks = []
+    for i in range(phones):
+        registered = asyncio.get_running_loop().create_future()
+        tasks.append(asyncio.create_task(phone(ports[i % len(ports)], f"phone_{i}", registered, received, stop)))
+        await registered
+    # let registry announcements reach every worker
+    await asyncio.sleep(1)
+
+    gate = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        async def post(i):
+            async with gate:
+                port = ports[(i + 1) % len(ports)]
+                async with session.post(f"http://127.0.0.1:{port}/api/command",
+                                        json={'phone': f"phone_{i % phones}", 'command': 'true'}) as resp:
+                    await resp.read()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(commands)))
+        while received[0] < commands and time.perf_counter() - start < 60:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return received[0], elapsed
+
+
+def run(workers, args):
+    hub = MessageHub(('127.0.0.1', args.hub_port))
+    threading.Thread(target=hub.serve_forever, daemon=True).start()
+    ports = [args.port + i for i in range(workers)]
+    procs = []
+    for i, port in enumerate(ports):
+        env = dict(os.environ, PORT=str(port), WORKER_ID=f"w{i}", CLUSTER_HUB=f"127.0.0.1:{args.hub_port}")
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py')], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    try:
+        async def main():
+            for port in ports:
+                await wait_for_port(port)
+            return await measure(ports, args.phones, args.commands, args.concurrency)
+        delivered, elapsed = asyncio.run(main())
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        hub.shutdown()
+        hub.server_close()
+    print(f"{workers} worker(s): {delivered}/{args.commands} commands delivered in {elapsed:6.2f}s "
+          f"-> {delivered / elapsed:8.0f} cmd/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--phones', type=int, default=200)
+    parser.add_argument('--commands', type=int, default=4000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--hub-port', type=int, default=7170)
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPU(s)")
+    for workers in (int(w) for w in args.workers.split(',')):
+        run(workers, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Connection-scaling benchmark for device WebSockets.
+
+Opens raw Engine.IO/Socket.IO WebSocket connections against a running
+server, registers each as a phone, keeps them alive (answering pings) and
+reports connect rate, how many stayed up, and the server's RSS when a pid
+is given.
+
+    ASYNC_MODE=gevent python server.py &
+    python benchmarks/connection_scaling.py --url ws://localhost:5000 --steps 1000,5000,10000 --pid $!
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+
+def server_rss_mb(pid):
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+async def device(url, index, ready, stop):
+    try:
+        async with websockets.connect(f"{url}/socket.io/?EIO=4&transport=websocket",
+                                      open_timeout=60, ping_interval=None) as ws:
+            await ws.recv()  # engine.io open packet
+            await ws.send('40')
+            await ws.recv()  # namespace connect ack
+            await ws.send('42' + json.dumps(['register', {'device_id': f"bench_{index}"}]))
+            ready.set_result(True)
+            while not stop.is_set():
+                try:
+                    packet = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                if packet == '2':
+                    await ws.send('3')
+    except Exception as exc:
+        if not ready.done():
+            ready.set_result(exc)
+
+
+async def run(url, steps, pid, hold, concurrency):
+    stop = asyncio.Event()
+    tasks = []
+    gate = asyncio.Semaphore(concurrency)
+    opened = 0
+    for target in steps:
+        start = time.perf_counter()
+
+        async def spawn(index):
+            async with gate:
+                ready = asyncio.get_running_loop().create_future()
+                tasks.append(asyncio.create_task(device(url, index, ready, stop)))
+                return await ready
+
+        results = await asyncio.gather(*(spawn(i) for i in range(opened, target)))
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for r in results if r is not True)
+        opened = target
+        await asyncio.sleep(hold)
+        alive = sum(1 for t in tasks if not t.done())
+        rss = server_rss_mb(pid)
+        rss_text = f"  server rss {rss:8.1f} MB" if rss is not None else ''
+        print(f"{target:7d} sockets: {len(results) / elapsed:8.0f} conn/s  failed {failed:6d}  "
+              f"alive after {hold}s {alive:7d}{rss_text}")
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='ws://localhost:5000')
+    parser.add_argument('--steps', default='100,1000,5000,10000')
+    parser.add_argument('--pid', type=int, help='server pid, to report its RSS')
+    parser.add_argument('--hold', type=float, default=5.0, help='seconds to hold each step')
+    parser.add_argument('--concurrency', type=int, default=200, help='simultaneous handshakes')
+    args = parser.parse_args()
+    steps = [int(s) for s in args.steps.split(',')]
+    asyncio.run(run(args.url, steps, args.pid, args.hold, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Requests/sec on ``/``: per-request ``render_template_string`` vs ``CachedPage``.
+
+Runs in-process through Flask's test client so only the view cost is
+measured, not the network stack.
+
+    python benchmarks/dashboard_page.py [--requests N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import render_template_string
+
+import server
+
+
+@server.app.route('/__legacy_control_panel')
+def legacy_control_panel():
+    return render_template_string(server.HTML_TEMPLATE)
+
+
+def bench(client, label, path, requests, headers=None):
+    client.get(path, headers=headers)
+    start = time.perf_counter()
+    size = 0
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        size = len(response.data)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {requests / elapsed:10.0f} req/s  {size:8d} bytes/response")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    client = server.app.test_client()
+    page = server.control_panel_page
+    bench(client, 'before: render_template_string', '/__legacy_control_panel', args.requests)
+    bench(client, 'after: identity', '/', args.requests)
+    bench(client, 'after: gzip', '/', args.requests, {'Accept-Encoding': 'gzip'})
+    if 'br' in page.variants:
+        bench(client, 'after: br', '/', args.requests, {'Accept-Encoding': 'br'})
+    bench(client, 'after: 304 revalidation', '/', args.requests, {'If-None-Match': f'"{page.etag}"'})
+
+
+if __name__ == '__main__':
+    main()
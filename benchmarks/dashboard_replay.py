@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Build a page that replays dashboard events in the browser.
+
+The dashboard from ``server.py`` is written out with the Socket.IO client
+and ``fetch`` replaced by stubs, plus a harness that feeds it a synthetic
+stream of ``phone_delta``, ``new_message``, ``command_response`` and
+``command_output`` events: first in one burst, then paced over animation
+frames, then paced again with the per-phone events wrapped in
+``event_batch`` arrays as the server sends them (unless
+``DASHBOARD_BATCH_INTERVAL`` is 0). Open the page in a browser; it reports
+dispatch time, frame times and how many DOM nodes are left.
+
+    python benchmarks/dashboard_replay.py [--events 10000] [--phones 2000] [--out dashboard_replay.html]
+"""
+import argparse
+import ast
+import json
+import os
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server.py')
+
+STUBS = """
+<script>
+    window.fetch = function() {
+        const result = {version: 0, full: true, phones: []};
+        return Promise.resolve({json: () => Promise.resolve(result)});
+    };
+    window.io = function() {
+        const handlers = {};
+        return {
+            on(event, handler) { (handlers[event] = handlers[event] || []).push(handler); },
+            emit() {},
+            fire(event, data) { (handlers[event] || []).forEach(handler => handler(data)); }
+        };
+    };
+</script>
+"""
+
+HARNESS = """
+<script>
+    const CONFIG = %(config)s;
+
+    function makeEvents() {
+        const events = [];
+        let seq = 0;
+        let rand = 1;
+        const random = () => (rand = (rand * 48271) %% 2147483647) / 2147483647;
+        const phoneId = i => `phone_${String(i).padStart(5, '0')}`;
+        const live = [];
+        for (let i = 0; i < Math.min(CONFIG.phones, CONFIG.events); i++) {
+            live.push(phoneId(i));
+            events.push(['phone_delta', {op: 'add', seq: ++seq, phone_id: phoneId(i),
+                                          phone: {id: phoneId(i), status: 'online', tags: []}}]);
+        }
+        let next = live.length;
+        while (events.length < CONFIG.events) {
+            const roll = random();
+            const phone = live[Math.floor(random() * live.length)];
+            if (roll < 0.25) {
+                const status = random() < 0.5 ? 'stale' : 'online';
+                events.push(['phone_delta', {op: 'update', seq: ++seq, phone_id: phone,
+                                              phone: {id: phone, status: status, tags: []}}]);
+            } else if (roll < 0.3) {
+                live.splice(live.indexOf(phone), 1);
+                events.push(['phone_delta', {op: 'remove', seq: ++seq, phone_id: phone}]);
+                live.push(phoneId(next));
+                events.push(['phone_delta', {op: 'add', seq: ++seq, phone_id: phoneId(next),
+                                              phone: {id: phoneId(next), status: 'online', tags: []}}]);
+                next++;
+            } else if (roll < 0.65) {
+                events.push(['new_message', {phone_id: phone, message: `Command: termux-battery-status ${events.length}`,
+                                              timestamp: new Date().toISOString()}]);
+            } else if (roll < 0.95) {
+                events.push(['command_response', {phone_id: phone, response: `level: ${events.length %% 100}`}]);
+            } else {
+                const id = `stream${events.length}`;
+                events.push(['command_output', {phone_id: phone, correlation_id: id, seq: 0,
+                                                 data: 'line of output '.repeat(20), done: true}]);
+            }
+        }
+        return events.slice(0, CONFIG.events);
+    }
+
+    const nextFrame = () => new Promise(resolve => requestAnimationFrame(resolve));
+
+    function percentile(values, p) {
+        const sorted = values.slice().sort((a, b) => a - b);
+        return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+    }
+
+    function report(lines) {
+        let out = document.getElementById('benchReport');
+        if (!out) {
+            out = document.createElement('pre');
+            out.id = 'benchReport';
+            out.style.cssText = 'position:fixed;bottom:0;left:0;z-index:9999;margin:0;padding:12px;' +
+                                'background:#000;color:#0f8;font:12px monospace;max-width:100%%';
+            document.body.appendChild(out);
+        }
+        out.textContent = lines.join('\\n');
+        console.log(lines.join('\\n'));
+    }
+
+    function fireBatched(events) {
+        let batch = [];
+        for (const [event, data] of events) {
+            if (event === 'phone_delta') {
+                socket.fire(event, data);
+            } else {
+                batch.push([event, data]);
+            }
+        }
+        if (batch.length) socket.fire('event_batch', batch);
+    }
+
+    async function replay(events, perFrame, batched) {
+        // Reconnecting resyncs to the stubbed empty registry
+        socket.fire('connect');
+        await nextFrame();
+        const frames = [];
+        let dispatch = 0;
+        let last = performance.now();
+        for (let i = 0; i < events.length; i += perFrame) {
+            const start = performance.now();
+            if (batched) {
+                fireBatched(events.slice(i, i + perFrame));
+            } else {
+                for (const [event, data] of events.slice(i, i + perFrame)) socket.fire(event, data);
+            }
+            dispatch += performance.now() - start;
+            await nextFrame();
+            const now = performance.now();
+            frames.push(now - last);
+            last = now;
+        }
+        await nextFrame();
+        return {dispatch: dispatch, frames: frames};
+    }
+
+    async function run() {
+        const events = makeEvents();
+        const lines = [`${events.length} events, up to ${CONFIG.phones} phones`];
+        const passes = [['burst', events.length, false], ['paced', CONFIG.perFrame, false],
+                        ['batched', CONFIG.perFrame, true]];
+        for (const [label, perFrame, batched] of passes) {
+            const before = performance.now();
+            const result = await replay(events, perFrame, batched);
+            lines.push(`${label.padEnd(8)} total ${(performance.now() - before).toFixed(0)} ms, ` +
+                       `dispatch ${result.dispatch.toFixed(0)} ms, frames ${result.frames.length}, ` +
+                       `frame p50 ${percentile(result.frames, 0.5).toFixed(1)} ms, ` +
+                       `p95 ${percentile(result.frames, 0.95).toFixed(1)} ms, ` +
+                       `max ${Math.max(...result.frames).toFixed(1)} ms`);
+            lines.push(`         DOM nodes ${document.getElementsByTagName('*').length}, ` +
+                       `live feed ${document.getElementById('liveFeed').childNodes.length}, ` +
+                       `device rows ${document.querySelectorAll('#phoneList .device-card').length}`);
+            report(lines);
+        }
+        report(lines.concat(['done']));
+    }
+
+    window.addEventListener('load', () => setTimeout(run, 100));
+</script>
+"""
+
+
+def dashboard_html():
+    """``HTML_TEMPLATE`` as served, read from server.py without importing it."""
+    with open(SERVER) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'HTML_TEMPLATE':
+            return ast.literal_eval(node.value)
+    raise SystemExit('HTML_TEMPLATE not found in server.py')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=10_000)
+    parser.add_argument('--phones', type=int, default=2_000)
+    parser.add_argument('--per-frame', type=int, default=100, help='events per frame in the paced pass')
+    parser.add_argument('--out', default='dashboard_replay.html')
+    args = parser.parse_args()
+
+    html = dashboard_html()
+    client = html.index('<script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/')
+    client_end = html.index('</script>', client) + len('</script>')
+    html = html[:client] + STUBS + html[client_end:]
+    config = json.dumps({'events': args.events, 'phones': args.phones, 'perFrame': args.per_frame})
+    html = html.replace('</body>', HARNESS % {'config': config} + '</body>')
+    with open(args.out, 'w') as f:
+        f.write(html)
+    print(f"wrote {args.out}; open it in a browser and read the report at the bottom of the page")
+
+
+if __name__ == '__main__':
+    main()
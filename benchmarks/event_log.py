@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Event log write throughput and startup replay time.
+
+Appends N message events across 1,000 phones, waits for them to be
+committed, then reopens the log and replays its tail into a ``MessageStore``
+the way server.py does at boot.
+
+    python benchmarks/event_log.py [--events 10000000] [--dir /tmp/events]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from event_log import EventLog
+from message_store import MessageStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=10_000_000)
+    parser.add_argument('--phones', type=int, default=1000)
+    parser.add_argument('--dir', help='log directory (default: a fresh temp dir, removed afterwards)')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='event-log-bench-')
+    try:
+        log = EventLog(directory)
+        store = MessageStore(journals=[log])
+        start = time.perf_counter()
+        for i in range(args.events):
+            store.append(f"phone_{i % args.phones}", 'info', f"response {i}", 'incoming')
+        appended = time.perf_counter() - start
+        log.flush()
+        committed = time.perf_counter() - start
+        fsyncs = log.fsyncs
+        log.close()
+        size = sum(os.path.getsize(p) for p in log.segments())
+        print(f"write:  {args.events} events  append {args.events / appended:10.0f} ev/s  "
+              f"durable {args.events / committed:10.0f} ev/s  {fsyncs} fsyncs  "
+              f"{len(log.segments())} segments  {size / 1e6:8.1f} MB")
+
+        start = time.perf_counter()
+        log = EventLog(directory)
+        opened = time.perf_counter() - start
+        store = MessageStore()
+        replayed = store.restore(log.replay_tail(store.max_count))
+        elapsed = time.perf_counter() - start
+        log.close()
+        print(f"replay: {replayed} events in {elapsed:6.2f}s (recovery {opened:5.2f}s)  "
+              f"{replayed / elapsed:10.0f} ev/s  store holds {store.stats()['messages']} messages")
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Fan-out load test: egress bytes and emit latency with 1,000 simulated phones.
+
+Connects simulated phones and dashboards through Flask-SocketIO's test
+client, has every phone send ``message_response`` events, and compares the
+room-targeted emits against the old broadcast-to-everyone behaviour.
+Dashboard events wait in the outbox between flushes, so each run sends
+the pending batches before counting what the dashboards received.
+
+    python benchmarks/fanout_load.py [--phones N] [--dashboards N] [--events N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+
+
+def egress(clients):
+    total = 0
+    for client in clients:
+        for packet in client.get_received():
+            total += len(json.dumps(packet['args']))
+    return total
+
+
+def connect(phones, dashboards, subscribed):
+    devices = []
+    for i in range(phones):
+        client = server.socketio.test_client(server.app)
+        client.emit('register', {'device_id': f"phone_{i}"})
+        devices.append(client)
+    boards = []
+    for i in range(dashboards):
+        client = server.socketio.test_client(server.app)
+        if i < subscribed:
+            client.emit('join_dashboard', {'phone_ids': [f"phone_{i}"]})
+        else:
+            client.emit('join_dashboard', {})
+        boards.append(client)
+    for client in devices + boards:
+        client.get_received()
+    return devices, boards
+
+
+def run(label, devices, boards, events, send):
+    start = time.perf_counter()
+    for i in range(events):
+        send(devices[i % len(devices)], i)
+    server.send_dashboard_batches()
+    elapsed = time.perf_counter() - start
+    device_bytes = egress(devices)
+    board_bytes = egress(boards)
+    print(f"{label:<10} devices {device_bytes:12d} B  dashboards {board_bytes:12d} B  "
+          f"{elapsed / events * 1e6:9.1f} us/event")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--phones', type=int, default=1000)
+    parser.add_argument('--dashboards', type=int, default=10)
+    parser.add_argument('--subscribed', type=int, default=5,
+                        help='dashboards that subscribe to a single phone instead of the firehose')
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    devices, boards = connect(args.phones, args.dashboards, args.subscribed)
+
+    def targeted(client, i):
+        client.emit('message_response', {'phone_id': f"phone_{i % args.phones}", 'message': f"ok {i}"})
+
+    def broadcast(client, i):
+        phone_id = f"phone_{i % args.phones}"
+        server.socketio.emit('new_message', {'phone_id': phone_id, 'message': f"INFO: ok {i}",
+                                             'timestamp': server.datetime.now().isoformat()})
+        server.socketio.emit('command_response', {'phone_id': phone_id, 'response': f"ok {i}"})
+
+    run('broadcast', devices, boards, args.events, broadcast)
+    run('targeted', devices, boards, args.events, targeted)
+
+
+if __name__ == '__main__':
+    main()
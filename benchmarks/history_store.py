@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""SQLite history store insert rate and paginated query latency.
+
+Loads N messages spread over 1,000 phones through the store's batched
+writer, then times ``page`` calls the way ``GET /api/phones/<id>/messages``
+makes them: the newest page, a page deep in the history (keyset ``before``)
+and a page filtered by message type.
+
+    python benchmarks/history_store.py [--rows 10000000] [--db /tmp/history.db]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history_store import HistoryStore
+
+TYPES = ('shell', 'info', 'command', 'ussd')
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--phones', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--db', help='database path (default: a fresh temp file, removed afterwards)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='history-bench-')
+    path = args.db or os.path.join(directory, 'history.db')
+    try:
+        store = HistoryStore(path)
+        start = time.perf_counter()
+        base = time.time() - args.rows / 1000
+        for i in range(args.rows):
+            store.append({'id': i + 1, 'phone_id': f"phone_{i % args.phones}",
+                          'type': TYPES[i // args.phones % len(TYPES)], 'content': f"response {i}", 'direction': 'incoming', 'ts': base + i / 1000})
+        store.close()
+        elapsed = time.perf_counter() - start
+        print(f"insert: {args.rows} rows in {elapsed:6.1f}s  {args.rows / elapsed:10.0f} rows/s  "
+              f"{os.path.getsize(path) / 1e6:8.1f} MB")
+
+        store = HistoryStore(path)
+        total = store.count()
+        rng = random.Random(1)
+        cases = {
+            'newest page': lambda phone: store.page(phone, limit=50),
+            'deep page': lambda phone: store.page(phone, before=rng.randint(total // 2, total), limit=50),
+            'by type': lambda phone: store.page(phone, limit=50, message_type='shell'),
+        }
+        for name, query in cases.items():
+            samples = []
+            for _ in range(args.queries):
+                phone = f"phone_{rng.randrange(args.phones)}"
+                t = time.perf_counter()
+                query(phone)
+                samples.append((time.perf_counter() - t) * 1000)
+            print(f"{name:12s} p50 {percentile(samples, 50):6.3f} ms  p99 {percentile(samples, 99):6.3f} ms  "
+                  f"max {max(samples):6.3f} ms")
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Memory benchmark: 1M messages across 1,000 phones.
+
+Compares the old unbounded list-of-dicts history with ``MessageStore``.
+Each variant runs in its own subprocess so RSS numbers don't bleed into
+each other.
+
+    python benchmarks/message_store_memory.py [--messages N] [--phones N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_legacy(messages, phones):
+    store = {}
+    for i in range(messages):
+        phone_id = f"phone_{i % phones}"
+        if phone_id not in store:
+            store[phone_id] = []
+        store[phone_id].append({
+            'type': 'info',
+            'content': f"response {i}",
+            'timestamp': datetime.now().isoformat(),
+            'direction': 'incoming'
+        })
+    return store
+
+
+def run_store(messages, phones):
+    from message_store import MessageStore
+    store = MessageStore()
+    for i in range(messages):
+        store.append(f"phone_{i % phones}", 'info', f"response {i}", 'incoming')
+    return store
+
+
+def child(variant, messages, phones):
+    before = rss_mb()
+    start = time.perf_counter()
+    store = (run_legacy if variant == 'legacy' else run_store)(messages, phones)
+    elapsed = time.perf_counter() - start
+    after = rss_mb()
+    print(f"{variant:>8}: rss before {before:8.1f} MB  after {after:8.1f} MB  "
+          f"delta {after - before:8.1f} MB  {messages / elapsed:10.0f} msg/s")
+    del store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--phones', type=int, default=1_000)
+    parser.add_argument('--variant', choices=['legacy', 'store'])
+    args = parser.parse_args()
+
+    if args.variant:
+        child(args.variant, args.messages, args.phones)
+        return
+
+    print(f"{args.messages} messages across {args.phones} phones")
+    for variant in ('legacy', 'store'):
+        subprocess.run([sys.executable, __file__, '--variant', variant,
+                        '--messages', str(args.messages), '--phones', str(args.phones)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Registry lock contention under mixed dashboard and device traffic.
+
+Worker threads run a mix of device registrations (writes) and command
+dispatch lookups (reads), each followed by a simulated emit. The baseline
+reproduces the old ``phone_lock`` pattern: one global lock around every read
+and write, held across the emit. The sharded registry reads without a lock
+and emits after its write lock is released.
+
+    python benchmarks/registry_contention.py [--threads 16] [--ops 20000] [--emit-us 50]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registry import DeviceRegistry
+
+
+class GlobalLockRegistry:
+    """The pre-sharding shape: a dict guarded by one lock, I/O included."""
+
+    def __init__(self, emit):
+        self.phones = {}
+        self.lock = threading.Lock()
+        self.emit = emit
+
+    def register(self, phone_id, sid):
+        with self.lock:
+            self.phones[phone_id] = {'sid': sid, 'connected_at': datetime.now()}
+            self.emit()
+
+    def dispatch(self, phone_id):
+        with self.lock:
+            phone = self.phones.get(phone_id)
+            if phone:
+                self.emit()
+
+    def list(self):
+        with self.lock:
+            return list(self.phones)
+
+
+class ShardedRegistry:
+
+    def __init__(self, emit):
+        self.registry = DeviceRegistry()
+        self.emit = emit
+
+    def register(self, phone_id, sid):
+        self.registry.register(phone_id, sid)
+        self.emit()
+
+    def dispatch(self, phone_id):
+        if self.registry.get(phone_id):
+            self.emit()
+
+    def list(self):
+        return self.registry.keys()
+
+
+def run(registry, threads, ops, phones, write_ratio):
+    for i in range(phones):
+        registry.register(f"phone_{i}", f"sid_{i}")
+    latencies = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        rng = random.Random(index)
+        samples = latencies[index]
+        barrier.wait()
+        for _ in range(ops):
+            phone = f"phone_{rng.randrange(phones)}"
+            roll = rng.random()
+            start = time.perf_counter()
+            if roll < write_ratio:
+                registry.register(phone, f"sid_{rng.randrange(1 << 30)}")
+            elif roll < write_ratio + 0.01:
+                registry.list()
+            else:
+                registry.dispatch(phone)
+            samples.append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    samples = sorted(s for per_thread in latencies for s in per_thread)
+    return elapsed, len(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=20_000, help='operations per thread')
+    parser.add_argument('--phones', type=int, default=2000)
+    parser.add_argument('--writes', type=float, default=0.1, help='fraction of operations that register')
+    parser.add_argument('--emit-us', type=float, default=50, help='simulated emit cost in microseconds')
+    args = parser.parse_args()
+
+    def emit():
+        # Sleeping releases the GIL like a socket write does.
+        time.sleep(args.emit_us / 1e6)
+
+    for label, registry in (('global lock', GlobalLockRegistry(emit)), ('sharded', ShardedRegistry(emit))):
+        elapsed, count, p50, p99 = run(registry, args.threads, args.ops, args.phones, args.writes)
+        print(f"{label:<12} {count / elapsed:10.0f} ops/s  p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Mass-disconnect benchmark: 10k devices dropping at once.
+
+Compares the old linear scan of ``connected_phones`` for each disconnect
+with ``DeviceRegistry.remove_sid``.
+
+    python benchmarks/registry_disconnect.py [--devices N]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from threading import Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registry import DeviceRegistry
+
+
+def legacy(devices):
+    phone_lock = Lock()
+    connected_phones = {
+        f"phone_{i}": {'sid': f"sid_{i}", 'connected_at': datetime.now(), 'last_seen': datetime.now()}
+        for i in range(devices)
+    }
+    start = time.perf_counter()
+    for i in range(devices):
+        sid = f"sid_{i}"
+        with phone_lock:
+            phones_to_remove = [pid for pid, data in connected_phones.items() if data['sid'] == sid]
+            for phone_id in phones_to_remove:
+                del connected_phones[phone_id]
+    return time.perf_counter() - start
+
+
+def indexed(devices):
+    registry = DeviceRegistry()
+    for i in range(devices):
+        registry.register(f"phone_{i}", f"sid_{i}")
+    start = time.perf_counter()
+    for i in range(devices):
+        registry.remove_sid(f"sid_{i}")
+    elapsed = time.perf_counter() - start
+    assert len(registry) == 0
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=10_000)
+    args = parser.parse_args()
+
+    for label, fn in (('linear scan', legacy), ('sid index', indexed)):
+        elapsed = fn(args.devices)
+        print(f"{label:<12} {args.devices} disconnects in {elapsed * 1000:9.1f} ms  "
+              f"({elapsed / args.devices * 1e6:7.2f} us each)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Bytes on the wire and codec CPU: JSON vs the compact msgpack encoding.
+
+Sizes are Engine.IO payload bytes of the Socket.IO packets each encoding
+produces (the binary encoding pays for a placeholder header packet plus the
+attachment). CPU is the time to build and parse the event payload.
+
+    python benchmarks/wire_protocol.py [--iterations 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from socketio import packet
+
+import wire
+
+
+def wire_bytes(event, payload):
+    encoded = packet.Packet(packet.EVENT, data=[event, payload]).encode()
+    frames = encoded if isinstance(encoded, list) else [encoded]
+    # Text frames carry a one-character Engine.IO type prefix.
+    return sum(len(f) if isinstance(f, bytes) else len(f.encode()) + 1 for f in frames)
+
+
+def per_call_us(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20_000)
+    args = parser.parse_args()
+    if wire.msgpack is None:
+        sys.exit('msgpack is not installed')
+
+    logcat = ''.join(f"10-18 12:00:{i % 60:02d}.123  1234  5678 I ActivityManager: Start proc {i} for service\n"
+                     for i in range(300))
+    cases = [
+        ('command', 'command', {'action': 'shell', 'command': 'dumpsys battery',
+                                'correlation_id': uuid.uuid4().hex, 'message_id': 123456}),
+        ('ussd command', 'command', {'action': 'ussd', 'command': 'ussd_response:1',
+                                     'session_id': 'ussd_phone_042_a1b2c3d4e5f6'}),
+        ('short response', 'message_response', {'phone_id': 'phone_042', 'type': 'shell',
+                                                'message': 'level: 87\nstatus: 2\nhealth: 2',
+                                                'correlation_id': uuid.uuid4().hex}),
+        ('logcat response', 'message_response', {'phone_id': 'phone_042', 'type': 'shell', 'message': logcat,
+                                                 'correlation_id': uuid.uuid4().hex}),
+    ]
+    print(f"{'payload':<16} {'json B':>8} {'msgpack B':>10} {'saved':>7} "
+          f"{'json enc+dec us':>16} {'msgpack enc+dec us':>19}")
+    for label, event, payload in cases:
+        packed = wire.encode(payload)
+        json_size = wire_bytes(event, payload)
+        compact_size = wire_bytes(event, packed)
+        # Large payloads are slow to encode; run fewer rounds of them.
+        iterations = args.iterations if json_size < 4096 else max(100, args.iterations // 50)
+        json_us = per_call_us(lambda: json.loads(json.dumps(payload, separators=(',', ':'))), iterations)
+        compact_us = per_call_us(lambda: wire.decode(wire.encode(payload)), iterations)
+        print(f"{label:<16} {json_size:8d} {compact_size:10d} {1 - compact_size / json_size:7.0%} "
+              f"{json_us:16.2f} {compact_us:19.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Multi-worker mode over a shared message bus.
+
+Each worker process owns the device sockets connected to it. Workers share
+two things through a bus:
+
+* Socket.IO fan-out, via ``BusManager`` (a python-socketio pub/sub client
+  manager), so ``socketio.emit(..., room=sid)`` reaches a phone no matter
+  which worker holds its socket.
+* The device registry, via ``Cluster``, which mirrors register/remove
+  announcements from other workers into the local ``DeviceRegistry``.
+* Commands for a phone owned by another worker, via ``Cluster``: the owner
+  tracks and delivers them, since the responses come back to it, and tells
+  the dispatching worker when they complete.
+
+The bus is pluggable: ``LocalBus`` works inside one process and
+``HubClient`` talks to a ``MessageHub`` over a local TCP socket, so neither
+needs an outside service.
+
+    python cluster.py --workers 4 --port 5000
+
+starts a hub and four ``server.py`` workers on ports 5000-5003; put a load
+balancer with sticky sessions in front of them.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+
+import socketio
+
+SOCKETIO_CHANNEL = 'socketio'
+CLUSTER_CHANNEL = 'cluster'
+HUB_CHANNEL = 'hub'
+
+
+class LocalBus:
+    """In-process bus; every subscriber of a channel gets every message."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+
+class MessageHub(socketserver.ThreadingTCPServer):
+    """Relays newline-delimited JSON frames between workers.
+
+    Workers introduce themselves with a ``hub`` frame; when a worker's
+    connection drops the hub tells the others with a ``worker_down`` message.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _HubHandler)
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+    def broadcast(self, line):
+        with self.clients_lock:
+            clients = list(self.clients.items())
+        for handler, lock in clients:
+            try:
+                with lock:
+                    handler.wfile.write(line)
+            except OSError:
+                pass
+
+
+class _HubHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        worker = None
+        with self.server.clients_lock:
+            self.server.clients[self] = threading.Lock()
+        try:
+            for line in self.rfile:
+                # Everything but the worker's introduction is relayed as is,
+                # without being parsed.
+                if line.startswith(_HUB_PREFIX):
+                    worker = json.loads(line)['message'].get('worker')
+                    continue
+                self.server.broadcast(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.server.clients_lock:
+                self.server.clients.pop(self, None)
+            if worker is not None:
+                self.server.broadcast(_frame(CLUSTER_CHANNEL, {'type': 'worker_down', 'worker': worker}))
+
+
+def _frame(channel, message):
+    return (json.dumps({'channel': channel, 'message': message}, separators=(',', ':')) + '\n').encode()
+
+
+_HUB_PREFIX = _frame(HUB_CHANNEL, None)[:-len(b'null}\n')]
+
+
+class HubClient:
+    """Bus backed by a ``MessageHub`` connection (``host:port``)."""
+
+    def __init__(self, address, worker_id):
+        host, port = address.rsplit(':', 1)
+        self._sock = socket.create_connection((host, int(port)))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._subscribers = {}
+        self._subscribers_lock = threading.Lock()
+        self._send(_frame(HUB_CHANNEL, {'worker': worker_id}))
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _send(self, data):
+        with self._send_lock:
+            self._sock.sendall(data)
+
+    def publish(self, channel, message):
+        self._send(_frame(channel, message))
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+    def _read(self):
+        with self._sock.makefile('rb') as stream:
+            for line in stream:
+                frame = json.loads(line)
+                with self._subscribers_lock:
+                    subscribers = list(self._subscribers.get(frame['channel'], ()))
+                for subscriber in subscribers:
+                    subscriber.put(frame['message'])
+
+
+class BusManager(socketio.PubSubManager):
+    """Socket.IO client manager that fans emits out over a bus."""
+
+    name = 'bus'
+
+    def __init__(self, bus, channel=SOCKETIO_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self._queue = bus.subscribe(channel)
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+
+class Cluster:
+    """Keeps the local registry in step with the other workers' devices.
+
+    ``on_delta`` is called with every registry delta caused by another
+    worker so the caller can forward it to its own dashboards.
+    ``on_command`` gets the commands other workers forward to this one, and
+    ``on_command_done`` / ``on_command_rejected`` the completions and
+    refusals of commands this one forwarded. ``on_ussd`` gets dashboard USSD
+    actions meant for sessions on this worker (or that may be).
+    """
+
+    def __init__(self, bus, registry, worker_id, on_delta=None, on_command=None, on_command_done=None,
+                 on_command_rejected=None, on_ussd=None):
+        self.bus = bus
+        self.registry = registry
+        self.worker_id = worker_id
+        self.on_delta = on_delta
+        self.on_command = on_command
+        self.on_command_done = on_command_done
+        self.on_command_rejected = on_command_rejected
+        self.on_ussd = on_ussd
+        self._queue = bus.subscribe(CLUSTER_CHANNEL)
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._publish({'type': 'sync_request'})
+
+    def _publish(self, message):
+        message['worker'] = self.worker_id
+        self.bus.publish(CLUSTER_CHANNEL, message)
+
+    def announce_register(self, phone_id, sid, tags=(), encoding='json'):
+        self._publish({'type': 'register', 'phone_id': phone_id, 'sid': sid, 'tags': list(tags),
+                       'encoding': encoding})
+
+    def announce_remove(self, phone_id, sid):
+        self._publish({'type': 'remove', 'phone_id': phone_id, 'sid': sid})
+
+    def forward_command(self, owner, phone_id, command, payload, keep_output=False):
+        self._publish({'type': 'command', 'owner': owner, 'phone_id': phone_id, 'command': command,
+                       'payload': payload, 'keep_output': keep_output})
+
+    def announce_command_done(self, origin, phone_id, correlation_id):
+        self._publish({'type': 'command_done', 'origin': origin, 'phone_id': phone_id,
+                       'correlation_id': correlation_id})
+
+    def announce_command_rejected(self, origin, phone_id, correlation_id, status, retry_after=None):
+        self._publish({'type': 'command_rejected', 'origin': origin, 'phone_id': phone_id,
+                       'correlation_id': correlation_id, 'status': status, 'retry_after': retry_after})
+
+    def forward_ussd(self, event, data, owner=None):
+        """Pass a dashboard USSD action on to ``owner``, or to every worker when it isn't known."""
+        self._publish({'type': 'ussd', 'owner': owner, 'event': event, 'data': data})
+
+    def _run(self):
+        while True:
+            self._apply(self._queue.get())
+
+    def _apply(self, message):
+        kind = message.get('type')
+        if message.get('worker') == self.worker_id:
+            return
+        if kind == 'register':
+            deltas = [self.registry.register(message['phone_id'], message['sid'], message['worker'],
+                                             message.get('tags', ()), message.get('encoding', 'json'))]
+        elif kind == 'remove':
+            deltas = [self.registry.remove(message['phone_id'], sid=message['sid'])]
+        elif kind == 'worker_down':
+            deltas = self.registry.remove_worker(message['worker'])
+        elif kind == 'command':
+            if message['owner'] == self.worker_id and self.on_command:
+                self.on_command(message)
+            return
+        elif kind == 'command_done':
+            if message['origin'] == self.worker_id and self.on_command_done:
+                self.on_command_done(message)
+            return
+        elif kind == 'command_rejected':
+            if message['origin'] == self.worker_id and self.on_command_rejected:
+                self.on_command_rejected(message)
+            return
+        elif kind == 'ussd':
+            if message['owner'] in (None, self.worker_id) and self.on_ussd:
+                self.on_ussd(message)
+            return
+        elif kind == 'sync_request':
+            for phone_id, record in self.registry.items():
+                if record.get('worker') == self.worker_id:
+                    self.announce_register(phone_id, record['sid'], record['tags'], record['encoding'])
+            return
+        else:
+            return
+        if self.on_delta:
+            for delta in deltas:
+                if delta:
+                    self.on_delta(delta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run server.py workers sharing a local message hub.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)),
+                        help='first worker port; worker i listens on port + i')
+    parser.add_argument('--hub-port', type=int, default=7070)
+    args = parser.parse_args()
+
+    hub = MessageHub(('127.0.0.1', args.hub_port))
+    threading.Thread(target=hub.serve_forever, daemon=True).start()
+    print(f"🛰️ Message hub on 127.0.0.1:{args.hub_port}")
+
+    server_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    workers = []
+    for i in range(args.workers):
+        env = dict(os.environ, PORT=str(args.port + i), WORKER_ID=f"w{i}",
+                   CLUSTER_HUB=f"127.0.0.1:{args.hub_port}")
+        workers.append(subprocess.Popen([sys.executable, server_py], env=env))
+
+    def stop(*_):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        stop()
+    finally:
+        hub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
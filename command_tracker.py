@@ -0,0 +1,203 @@
+"""Command correlation and round-trip latency tracking.
+
+Every dispatched command gets a globally unique correlation id. The tracker
+records when it was dispatched, acknowledged (``command_ack``) and completed
+(the matching ``message_response``). Devices that don't echo the id back
+are matched to their oldest pending command.
+
+Latencies go into fixed log-scale histograms, one per phone and one for the
+whole fleet, so recording is O(1) and percentiles never need the raw samples.
+"""
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from threading import Lock
+
+PENDING_TTL = float(os.environ.get('COMMAND_PENDING_TTL', 300))
+COMPLETED_HISTORY = int(os.environ.get('COMMAND_COMPLETED_HISTORY', 10000))
+
+# Bucket upper bounds in milliseconds: 1ms .. ~20 minutes, 25% apart.
+BUCKET_BOUNDS = [1.25 ** i for i in range(64)]
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'total', 'sum_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        index = 0 if ms <= 1 else min(math.ceil(math.log(ms, 1.25)), len(BUCKET_BOUNDS))
+        self.counts[index] += 1
+        self.total += 1
+        self.sum_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = p / 100 * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[index], self.max_ms) if index < len(BUCKET_BOUNDS) else self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'mean_ms': round(self.sum_ms / self.total, 2) if self.total else None,
+            'p50_ms': _round(self.percentile(50)),
+            'p95_ms': _round(self.percentile(95)),
+            'p99_ms': _round(self.percentile(99)),
+            'max_ms': round(self.max_ms, 2) if self.total else None
+        }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+class CommandRecord:
+    __slots__ = ('correlation_id', 'phone_id', 'command', 'message_id', 'origin',
+                 'dispatched_at', 'acked_at', 'completed_at')
+
+    def __init__(self, correlation_id, phone_id, command, message_id, origin=None):
+        self.correlation_id = correlation_id
+        self.phone_id = phone_id
+        self.command = command
+        self.message_id = message_id
+        self.origin = origin
+        self.dispatched_at = time.time()
+        self.acked_at = None
+        self.completed_at = None
+
+    def to_dict(self):
+        def ms_since_dispatch(ts):
+            return round((ts - self.dispatched_at) * 1000, 2) if ts else None
+        return {
+            'correlation_id': self.correlation_id,
+            'phone_id': self.phone_id,
+            'command': self.command,
+            'message_id': self.message_id,
+            'status': 'completed' if self.completed_at else 'acked' if self.acked_at else 'pending',
+            'dispatched_at': self.dispatched_at,
+            'ack_ms': ms_since_dispatch(self.acked_at),
+            'round_trip_ms': ms_since_dispatch(self.completed_at)
+        }
+
+
+class CommandTracker:
+
+    def __init__(self, pending_ttl=PENDING_TTL, completed_history=COMPLETED_HISTORY):
+        self.pending_ttl = pending_ttl
+        self._pending = OrderedDict()
+        self._pending_by_phone = {}
+        self._completed = OrderedDict()
+        self._completed_history = completed_history
+        self._fleet = LatencyHistogram()
+        self._phones = {}
+        self._lock = Lock()
+        self.expired = 0
+
+    def dispatch(self, phone_id, command, message_id=None, correlation_id=None, origin=None):
+        """Register a dispatched command and return its correlation id.
+
+        ``origin`` is the worker that dispatched a command forwarded to this
+        one in cluster mode; it is told when the command completes.
+        """
+        record = CommandRecord(correlation_id or uuid.uuid4().hex, phone_id, command, message_id, origin)
+        with self._lock:
+            self._expire(record.dispatched_at)
+            self._pending[record.correlation_id] = record
+            pending = self._pending_by_phone.setdefault(phone_id, deque())
+            self._drain(pending)
+            pending.append(record.correlation_id)
+        return record.correlation_id
+
+    def cancel(self, correlation_id):
+        """Forget a pending command that was never delivered."""
+        with self._lock:
+            return self._pending.pop(correlation_id, None)
+
+    def ack(self, correlation_id):
+        with self._lock:
+            record = self._pending.get(correlation_id)
+            if record is not None and record.acked_at is None:
+                record.acked_at = time.time()
+            return record
+
+    def complete(self, phone_id, correlation_id=None):
+        """Mark a command done; without an id, the phone's oldest pending one."""
+        now = time.time()
+        with self._lock:
+            if correlation_id is None:
+                pending = self._pending_by_phone.get(phone_id)
+                while pending and correlation_id not in self._pending:
+                    correlation_id = pending.popleft()
+            record = self._pending.pop(correlation_id, None)
+            if record is None:
+                return None
+            pending = self._pending_by_phone.get(record.phone_id)
+            if pending is not None:
+                self._drain(pending)
+                if not pending:
+                    del self._pending_by_phone[record.phone_id]
+            record.completed_at = now
+            ms = (now - record.dispatched_at) * 1000
+            self._fleet.record(ms)
+            histogram = self._phones.get(record.phone_id)
+            if histogram is None:
+                histogram = self._phones[record.phone_id] = LatencyHistogram()
+            histogram.record(ms)
+            self._completed[correlation_id] = record
+            if len(self._completed) > self._completed_history:
+                self._completed.popitem(last=False)
+            return record
+
+    def _drain(self, pending):
+        # Drop ids at the head of a phone's queue that completed out of
+        # order or expired.
+        while pending and pending[0] not in self._pending:
+            pending.popleft()
+
+    def get(self, correlation_id):
+        with self._lock:
+            return self._pending.get(correlation_id) or self._completed.get(correlation_id)
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def _expire(self, now):
+        cutoff = now - self.pending_ttl
+        while self._pending:
+            correlation_id, record = next(iter(self._pending.items()))
+            if record.dispatched_at >= cutoff:
+                break
+            del self._pending[correlation_id]
+            self.expired += 1
+
+    def latency(self, phone_id=None, slowest=20):
+        """Fleet-wide latency summary plus the ``slowest`` phones by p95."""
+        with self._lock:
+            if phone_id is not None:
+                histogram = self._phones.get(phone_id)
+                return {
+                    'phone_id': phone_id,
+                    'pending': len(self._pending_by_phone.get(phone_id, ())),
+                    'latency': histogram.summary() if histogram else LatencyHistogram().summary()
+                }
+            phones = sorted(self._phones.items(), key=lambda item: item[1].percentile(95), reverse=True)
+            return {
+                'fleet': self._fleet.summary(),
+                'pending': len(self._pending),
+                'expired': self.expired,
+                'slowest_phones': [dict(phone_id=pid, **h.summary()) for pid, h in phones[:slowest]]
+            }
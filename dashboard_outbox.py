@@ -0,0 +1,168 @@
+"""Per-dashboard outbound aggregation.
+
+The Socket.IO client manager hands per-phone dashboard events to a
+``DashboardOutbox`` instead of writing them to each dashboard socket (a
+member of the dashboard room); devices and other sockets in the same
+audience still get the event directly. Every dashboard socket gets its own
+box, flushed every ``DASHBOARD_BATCH_INTERVAL`` seconds
+(50 ms by default; 0 turns the outbox off) as a single ``event_batch`` event
+(``[[event, payload], ...]``).
+Since the diverting happens in the manager, events emitted by other workers
+in cluster mode land in the same boxes.
+
+On the way in, a box:
+
+- merges a ``command_response`` into the ``new_message`` queued just before
+  it for the same device response (the pair ``handle_message_response``
+  emits) into one ``message_response`` carrying the text once,
+- admits at most ``rate`` events per second and ``max_batch`` per flush;
+  the rest are dropped and, with ``overflow='summarize'``, counted per
+  phone in an ``events_suppressed`` event at the next flush.
+
+Streamed output and transfer progress are batched but never dropped.
+``merged`` and ``suppressed`` count the events coalesced either way.
+"""
+import os
+import time
+from threading import Lock
+
+import socketio
+
+BATCH_INTERVAL = float(os.environ.get('DASHBOARD_BATCH_INTERVAL', 0.05))
+BATCH_MAX = int(os.environ.get('DASHBOARD_BATCH_MAX', 500))
+MAX_EVENTS_PER_SEC = float(os.environ.get('DASHBOARD_MAX_EVENTS_PER_SEC', 200))
+OVERFLOW = os.environ.get('DASHBOARD_OVERFLOW', 'summarize')
+
+EVENTS = frozenset(('new_message', 'command_response', 'command_output', 'transfer_progress'))
+LIMITED_EVENTS = frozenset(('new_message', 'command_response'))
+
+
+class _Box:
+    __slots__ = ('events', 'tokens', 'refilled', 'dropped')
+
+    def __init__(self, tokens, now):
+        self.events = []
+        self.tokens = tokens
+        self.refilled = now
+        self.dropped = {}
+
+
+class DashboardOutbox:
+
+    def __init__(self, interval=BATCH_INTERVAL, max_batch=BATCH_MAX, rate=MAX_EVENTS_PER_SEC, overflow=OVERFLOW):
+        """``rate`` <= 0 turns the per-second limit off; ``overflow`` is ``'summarize'`` or ``'drop'``."""
+        self.interval = interval
+        self.max_batch = max_batch
+        self.rate = rate
+        self.overflow = overflow
+        self._boxes = {}
+        self._lock = Lock()
+        self.merged = 0
+        self.suppressed = 0
+
+    def add(self, sid, event, payload):
+        now = time.monotonic()
+        with self._lock:
+            box = self._boxes.get(sid)
+            if box is None:
+                box = self._boxes[sid] = _Box(self.rate, now)
+            if event == 'command_response' and self._merge(box, payload):
+                self.merged += 1
+                return
+            if event in LIMITED_EVENTS and not self._admit(box, now):
+                self.suppressed += 1
+                phone_id = payload.get('phone_id')
+                box.dropped[phone_id] = box.dropped.get(phone_id, 0) + 1
+                return
+            box.events.append([event, payload])
+
+    def drain(self):
+        """Empty every box; returns ``[(sid, events), ...]`` for the ones that had any."""
+        ready = []
+        with self._lock:
+            for sid, box in self._boxes.items():
+                if box.dropped:
+                    if self.overflow == 'summarize':
+                        box.events.append(['events_suppressed', {
+                            'total': sum(box.dropped.values()),
+                            'phones': box.dropped
+                        }])
+                    box.dropped = {}
+                if box.events:
+                    ready.append((sid, box.events))
+                    box.events = []
+        return ready
+
+    def forget(self, sid):
+        with self._lock:
+            self._boxes.pop(sid, None)
+
+    def _admit(self, box, now):
+        if len(box.events) >= self.max_batch:
+            return False
+        if self.rate > 0:
+            box.tokens = min(self.rate, box.tokens + (now - box.refilled) * self.rate)
+            box.refilled = now
+            if box.tokens < 1:
+                return False
+            box.tokens -= 1
+        return True
+
+    @staticmethod
+    def _merge(box, response):
+        if not box.events:
+            return False
+        event, message = box.events[-1]
+        # Only the new_message emitted for a device response carries a type.
+        if (event != 'new_message' or 'type' not in message or message['phone_id'] != response['phone_id']
+                or message.get('correlation_id') != response.get('correlation_id')):
+            return False
+        box.events[-1] = ['message_response', {
+            'phone_id': response['phone_id'],
+            'type': message['type'],
+            'response': response['response'],
+            'correlation_id': response.get('correlation_id'),
+            'timestamp': message['timestamp']
+        }]
+        return True
+
+    def __len__(self):
+        return len(self._boxes)
+
+
+class OutboxManager(socketio.Manager):
+    """Client manager that diverts ``EVENTS`` to ``outbox``, one box per dashboard socket.
+
+    Only members of ``dashboard_room`` are batched; the event goes to every
+    other recipient unchanged.
+    """
+
+    outbox = None
+    dashboard_room = 'dashboards'
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        if self.outbox is None or event not in EVENTS or callback is not None:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback,
+                                to=to, **kwargs)
+        if namespace not in self.rooms:
+            return
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        dashboards = self.rooms[namespace].get(self.dashboard_room, {})
+        diverted = []
+        direct = False
+        for sid, _ in self.get_participants(namespace, to or room):
+            if sid in skip_sid:
+                continue
+            if sid in dashboards:
+                self.outbox.add(sid, event, data)
+                diverted.append(sid)
+            else:
+                direct = True
+        if direct:
+            super().emit(event, data, namespace, room=room, skip_sid=skip_sid + diverted, to=to, **kwargs)
+
+
+def with_outbox(manager_class):
+    """``manager_class`` (e.g. a pub/sub manager) with ``OutboxManager`` under its local delivery."""
+    return type('Outbox' + manager_class.__name__, (manager_class, OutboxManager), {})
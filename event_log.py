@@ -0,0 +1,309 @@
+"""Durable append-only event log.
+
+Events are JSON lines written to numbered segment files
+(``events-<first seq>.log``). ``append`` only buffers the event; a native
+writer thread commits the buffer every ``flush_interval`` seconds with a
+single write and one fsync (group commit), so request handlers never wait on
+the disk. When a segment reaches ``segment_bytes`` a new one is started, and
+once more than ``max_segments`` sealed segments exist they are compacted in
+the background into one segment that keeps only the newest
+``keep_per_phone`` events per phone.
+
+Each sealed segment gets a ``.phones`` index next to it listing the phones
+it holds. On startup a torn final line (from a crash mid-write) is truncated
+away; ``replay`` streams every surviving event back in sequence order, while
+``replay_tail`` reads segments newest first and stops as soon as the indexes
+show that no older segment holds a phone with room left in its ring buffer.
+"""
+import base64
+import json
+import os
+import time
+
+from native_thread import allocate_lock, sleep, start_thread
+
+SEGMENT_BYTES = int(os.environ.get('EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024))
+FLUSH_INTERVAL = float(os.environ.get('EVENT_LOG_FLUSH_INTERVAL', 0.05))
+MAX_SEGMENTS = int(os.environ.get('EVENT_LOG_MAX_SEGMENTS', 8))
+KEEP_PER_PHONE = int(os.environ.get('EVENT_LOG_KEEP_PER_PHONE', 500))
+RECOVERY_TAIL_BYTES = 1024 * 1024
+
+# Decoding str lines directly skips json.loads' per-call encoding sniffing.
+_decode = json.JSONDecoder().decode
+
+
+def json_default(value):
+    """``json.dumps`` fallback: bytes (binary frames, msgpack payloads) go in base64."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+_encode = json.JSONEncoder(separators=(',', ':'), default=json_default).encode
+
+
+def _segment_name(first_seq):
+    return f"events-{first_seq:016d}.log"
+
+
+def _index_path(segment):
+    return segment[:-len('.log')] + '.phones'
+
+
+def _read_index(segment):
+    """Phones listed in ``segment``'s index, or None if it has no (intact) index."""
+    try:
+        with open(_index_path(segment), encoding='utf-8') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_index(segment, phones):
+    tmp = _index_path(segment) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(sorted(phones, key=str), f)
+    os.replace(tmp, _index_path(segment))
+
+
+def _remove_index(segment):
+    try:
+        os.remove(_index_path(segment))
+    except FileNotFoundError:
+        pass
+
+
+def _line_start(f, offset):
+    """Start of the line holding ``offset``, reading backwards as far as it takes."""
+    while offset > 0:
+        block_start = max(0, offset - RECOVERY_TAIL_BYTES)
+        f.seek(block_start)
+        newline = f.read(offset - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        offset = block_start
+    return 0
+
+
+class EventLog:
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, flush_interval=FLUSH_INTERVAL,
+                 max_segments=MAX_SEGMENTS, keep_per_phone=KEEP_PER_PHONE):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.max_segments = max_segments
+        self.keep_per_phone = keep_per_phone
+        os.makedirs(directory, exist_ok=True)
+        self._lock = allocate_lock()
+        self._buffer = []
+        self._closed = False
+        self._compacting = False
+        self.seq = self._recover()
+        self.committed = self.seq
+        self.fsyncs = 0
+        segments = self.segments()
+        self._path = segments[-1] if segments else os.path.join(directory, _segment_name(self.seq + 1))
+        self._file = open(self._path, 'ab')
+        # Phones in the open segment; unknown for one left over from an
+        # earlier run, which then never gets an index.
+        self._phones = set()
+        self._segment_phones = None if self._file.tell() else set()
+        self._done = allocate_lock()
+        self._done.acquire()
+        start_thread(self._run, ())
+
+    def segments(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith('events-') and name.endswith('.log'))
+
+    def append(self, event):
+        """Buffer ``event`` (a dict) and return its sequence number.
+
+        The event is encoded here, so one that can't be raises ``TypeError``
+        to the caller instead of stopping the writer thread.
+        """
+        event.pop('seq', None)
+        body = _encode(event)
+        with self._lock:
+            self._phones.add(event.get('phone_id'))
+            self.seq += 1
+            event['seq'] = self.seq
+            self._buffer.append('{"seq":%d%s%s\n' % (self.seq, ',' if len(body) > 2 else '', body[1:]))
+            return self.seq
+
+    def wait_for(self, seq, timeout=None):
+        """Block until ``seq`` is on disk. Uses the (possibly patched) ``time.sleep``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.committed < seq:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(self.flush_interval / 2)
+        return True
+
+    def flush(self):
+        return self.wait_for(self.seq)
+
+    def close(self):
+        self._closed = True
+        self._done.acquire()
+        self._file.close()
+
+    def replay(self, since_seq=0):
+        """Yield logged events with ``seq > since_seq``, oldest first."""
+        last = since_seq
+        for path in self.segments():
+            with open(path, encoding='utf-8', newline='\n') as f:
+                for line in f:
+                    try:
+                        event = _decode(line)
+                    except ValueError:
+                        break
+                    # A compaction interrupted before deleting its inputs
+                    # leaves duplicates behind; sequence order skips them.
+                    if event['seq'] > last:
+                        last = event['seq']
+                        yield event
+
+    def replay_tail(self, keep_per_phone):
+        """Return the newest ``keep_per_phone`` events of every phone, oldest first.
+
+        This is all a ring buffer of that size can hold after a full
+        ``replay``, without reading segments that can't contribute to it.
+        """
+        segments = self.segments()
+        # older[i]: every phone in segments[0..i], or None if one lacks an index.
+        older = []
+        phones = set()
+        for path in segments:
+            index = _read_index(path) if phones is not None else None
+            phones = phones | index if index is not None else None
+            older.append(phones)
+        kept = {}
+        last = float('inf')
+        for i in reversed(range(len(segments))):
+            if older[i] is not None and all(len(kept.get(p, ())) >= keep_per_phone for p in older[i]):
+                break
+            with open(segments[i], encoding='utf-8', newline='\n') as f:
+                lines = f.readlines()
+            for line in reversed(lines):
+                try:
+                    event = _decode(line)
+                except ValueError:
+                    continue
+                # Reading backwards, duplicates left by an interrupted
+                # compaction show up out of sequence order.
+                if event['seq'] >= last:
+                    continue
+                last = event['seq']
+                events = kept.setdefault(event.get('phone_id'), [])
+                if len(events) < keep_per_phone:
+                    events.append(event)
+        return sorted((event for events in kept.values() for event in events), key=lambda event: event['seq'])
+
+    def _run(self):
+        try:
+            while not self._closed:
+                sleep(self.flush_interval)
+                self._commit()
+            self._commit()
+        finally:
+            self._done.release()
+
+    def _commit(self):
+        with self._lock:
+            batch, self._buffer, last_seq = self._buffer, [], self.seq
+            phones, self._phones = self._phones, set()
+        if not batch:
+            return
+        if self._segment_phones is not None:
+            self._segment_phones |= phones
+        self._file.write(''.join(batch).encode())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+        self.committed = last_seq
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        if self._segment_phones is not None:
+            _write_index(self._path, self._segment_phones)
+        self._segment_phones = set()
+        self._path = os.path.join(self.directory, _segment_name(self.committed + 1))
+        self._file = open(self._path, 'ab')
+        sealed = self.segments()[:-1]
+        if len(sealed) > self.max_segments and not self._compacting:
+            self._compacting = True
+            start_thread(self._compact, (sealed,))
+
+    def _compact(self, sealed):
+        try:
+            latest = {}
+            for path in sealed:
+                with open(path, 'rb') as f:
+                    for line in f:
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            break
+                        kept = latest.setdefault(event.get('phone_id'), [])
+                        kept.append((event['seq'], line))
+                        if len(kept) > 2 * self.keep_per_phone:
+                            del kept[:-self.keep_per_phone]
+            lines = sorted(item for kept in latest.values() for item in kept[-self.keep_per_phone:])
+            tmp = sealed[0] + '.compact'
+            with open(tmp, 'wb') as f:
+                f.writelines(line for _, line in lines)
+                f.flush()
+                os.fsync(f.fileno())
+            # Until the new index is written the segment must read as unindexed.
+            _remove_index(sealed[0])
+            os.replace(tmp, sealed[0])
+            _write_index(sealed[0], latest)
+            for path in sealed[1:]:
+                os.remove(path)
+                _remove_index(path)
+        finally:
+            self._compacting = False
+
+    def _recover(self):
+        """Truncate a torn tail and return the last sequence number on disk.
+
+        Only the end of the newest segment is read: a crash can only have
+        damaged the last, partially written lines. A segment is only removed
+        once it holds no intact event at all.
+        """
+        for path in reversed(self.segments()):
+            size = os.path.getsize(path)
+            with open(path, 'r+b') as f:
+                good, last_seq = self._last_event(f, size)
+                if good != size:
+                    f.truncate(good)
+            if last_seq is not None:
+                return last_seq
+            os.remove(path)
+            _remove_index(path)
+        return 0
+
+    @staticmethod
+    def _last_event(f, size):
+        """Return ``(end, seq)`` of the last intact event, or ``(0, None)``."""
+        end = size
+        while True:
+            start = _line_start(f, max(0, end - RECOVERY_TAIL_BYTES))
+            f.seek(start)
+            lines = f.read(end - start).split(b'\n')
+            good = start
+            last_seq = None
+            for line in lines[:-1]:
+                try:
+                    last_seq = json.loads(line)['seq']
+                except ValueError:
+                    break
+                good += len(line) + 1
+            if last_seq is not None or start == 0:
+                return good, last_seq
+            # Nothing intact this far back; everything from ``start`` on goes.
+            end = start
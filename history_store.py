@@ -0,0 +1,140 @@
+"""Queryable message history in SQLite.
+
+``MessageStore`` only keeps the newest messages per phone in memory; this
+store keeps all of them on disk so the API can page back through a phone's
+history. ``append`` only buffers the message, and a native writer thread
+inserts each batch with one ``executemany`` in a single transaction. The
+database runs in WAL mode, so API reads never wait for the writer.
+
+Pages are fetched with keyset pagination on ``(ts, id)``: ``before`` is the
+id of the oldest message of the previous page, and every page is a single
+index range scan no matter how deep into the history it is.
+"""
+import json
+import os
+import sqlite3
+from datetime import datetime
+from threading import Lock
+
+from event_log import json_default
+from native_thread import allocate_lock, sleep, start_thread
+
+FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 0.2))
+MAX_PAGE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    phone_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    content TEXT,
+    direction TEXT,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_phone_ts ON messages (phone_id, ts);
+CREATE INDEX IF NOT EXISTS messages_phone_type_ts ON messages (phone_id, type, ts);
+"""
+
+
+def _connect(path, check_same_thread=True):
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class HistoryStore:
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._reader = _connect(path, check_same_thread=False)
+        self._reader.executescript(SCHEMA)
+        self._read_lock = Lock()
+        self._lock = allocate_lock()
+        self._buffer = []
+        self._closed = False
+        self.written = 0
+        self._done = allocate_lock()
+        self._done.acquire()
+        start_thread(self._run, ())
+
+    def append(self, event):
+        """Buffer a ``message`` event in the shape ``MessageStore`` journals.
+
+        Content that isn't a string is stored as JSON (bytes in base64);
+        encoding happens here so a bad value fails for the caller, not the
+        writer thread.
+        """
+        content = event['content']
+        if content is not None and not isinstance(content, str):
+            content = json.dumps(content, default=json_default)
+        row = (event['id'], event['phone_id'], event['type'], content, event['direction'], event['ts'])
+        with self._lock:
+            self._buffer.append(row)
+
+    def close(self):
+        self._closed = True
+        self._done.acquire()
+        self._reader.close()
+
+    def page(self, phone_id, before=None, limit=50, message_type=None):
+        """Return up to ``limit`` messages older than message ``before``, newest first."""
+        limit = max(1, min(limit, MAX_PAGE))
+        sql = 'SELECT id, type, content, ts, direction FROM messages WHERE phone_id = ?'
+        params = [phone_id]
+        if message_type:
+            sql += ' AND type = ?'
+            params.append(message_type)
+        with self._read_lock:
+            if before is not None:
+                row = self._reader.execute('SELECT ts FROM messages WHERE id = ?', (before,)).fetchone()
+                if row is None:
+                    return []
+                sql += ' AND (ts, id) < (?, ?)'
+                params += [row[0], before]
+            sql += ' ORDER BY ts DESC, id DESC LIMIT ?'
+            params.append(limit)
+            rows = self._reader.execute(sql, params).fetchall()
+        return [{
+            'id': message_id,
+            'type': kind,
+            'content': content,
+            'timestamp': datetime.fromtimestamp(ts).isoformat(),
+            'direction': direction
+        } for message_id, kind, content, ts, direction in rows]
+
+    def last_id(self):
+        with self._read_lock:
+            return self._reader.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+
+    def count(self, phone_id=None):
+        with self._read_lock:
+            if phone_id is None:
+                return self._reader.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            return self._reader.execute('SELECT COUNT(*) FROM messages WHERE phone_id = ?',
+                                        (phone_id,)).fetchone()[0]
+
+    def _run(self):
+        conn = _connect(self.path)
+        try:
+            while not self._closed:
+                sleep(self.flush_interval)
+                self._write(conn)
+            self._write(conn)
+        finally:
+            conn.close()
+            self._done.release()
+
+    def _write(self, conn):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        with conn:
+            # Replayed or duplicated ids are already stored; keep the first copy.
+            conn.executemany('INSERT OR IGNORE INTO messages (id, phone_id, type, content, direction, ts) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', batch)
+        self.written += len(batch)
@@ -0,0 +1,105 @@
+"""Heartbeat-based device liveness.
+
+Devices send a ``heartbeat`` event every few seconds (any device traffic
+counts too). ``beat`` records the time in a plain dict without a lock and,
+at most once per bucket interval, files the phone under the time bucket of
+its latest beat. The sweeper walks only the buckets that have aged past the
+stale or offline cutoffs, so a sweep costs O(phones that went quiet), not
+O(fleet). Phones that beat again after being filed are found in a newer
+bucket and skipped when their old bucket comes up.
+
+A phone silent for ``stale_after`` seconds is reported stale; one silent for
+``offline_after`` is reported offline and forgotten, and the server drops it
+as if its socket had closed. Only phones passed to ``watch`` (devices that
+asked for heartbeats when they registered) are tracked; ``beat`` ignores the
+rest, which are left to Engine.IO's ping timeout.
+"""
+import os
+import time
+from threading import Lock
+
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 15))
+STALE_AFTER = float(os.environ.get('HEARTBEAT_STALE_AFTER', 3 * HEARTBEAT_INTERVAL))
+OFFLINE_AFTER = float(os.environ.get('HEARTBEAT_OFFLINE_AFTER', 8 * HEARTBEAT_INTERVAL))
+BUCKET_SECONDS = float(os.environ.get('HEARTBEAT_BUCKET_SECONDS', 5))
+
+
+class LivenessTracker:
+
+    def __init__(self, stale_after=STALE_AFTER, offline_after=OFFLINE_AFTER, bucket_seconds=BUCKET_SECONDS):
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.bucket_seconds = bucket_seconds
+        self._last_seen = {}
+        self._filed = {}
+        self._buckets = {}
+        self._stale_buckets = {}
+        self._stale = set()
+        self._stale_cursor = None
+        self._offline_cursor = None
+        self._lock = Lock()
+
+    def watch(self, phone_id, now=None):
+        """Start tracking a phone that sends heartbeats."""
+        if now is None:
+            now = time.monotonic()
+        self._last_seen.setdefault(phone_id, now)
+        self.beat(phone_id, now)
+
+    def beat(self, phone_id, now=None):
+        """Record a sign of life; returns ``True`` if the phone was stale."""
+        if phone_id not in self._last_seen:
+            return False
+        if now is None:
+            now = time.monotonic()
+        self._last_seen[phone_id] = now
+        bucket = int(now // self.bucket_seconds)
+        if self._filed.get(phone_id) != bucket:
+            self._filed[phone_id] = bucket
+            self._buckets.setdefault(bucket, set()).add(phone_id)
+        if phone_id in self._stale:
+            self._stale.discard(phone_id)
+            return True
+        return False
+
+    def forget(self, phone_id):
+        self._last_seen.pop(phone_id, None)
+        self._filed.pop(phone_id, None)
+        self._stale.discard(phone_id)
+
+    def is_stale(self, phone_id):
+        return phone_id in self._stale
+
+    def last_seen(self, phone_id):
+        return self._last_seen.get(phone_id)
+
+    def sweep(self, now=None):
+        """Return ``(newly_stale, offline)`` lists of phone ids."""
+        if now is None:
+            now = time.monotonic()
+        stale, offline = [], []
+        with self._lock:
+            # A bucket is due once every beat filed in it is past the cutoff.
+            due = int((now - self.stale_after) // self.bucket_seconds)
+            self._stale_cursor = self._walk(self._buckets, self._stale_cursor, due, stale)
+            for phone_id, bucket in stale:
+                self._stale.add(phone_id)
+                self._stale_buckets.setdefault(bucket, set()).add(phone_id)
+            due = int((now - self.offline_after) // self.bucket_seconds)
+            self._offline_cursor = self._walk(self._stale_buckets, self._offline_cursor, due, offline)
+        for phone_id, _ in offline:
+            self.forget(phone_id)
+        return [phone_id for phone_id, _ in stale], [phone_id for phone_id, _ in offline]
+
+    def _walk(self, buckets, cursor, due, found):
+        if cursor is None:
+            cursor = min(buckets, default=due)
+        for bucket in range(cursor, due):
+            for phone_id in buckets.pop(bucket, ()):
+                # Phones that beat since being filed here live in a newer bucket.
+                if self._filed.get(phone_id) == bucket:
+                    found.append((phone_id, bucket))
+        return max(cursor, due)
+
+    def __len__(self):
+        return len(self._last_seen)
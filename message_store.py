@@ -0,0 +1,168 @@
+"""Bounded per-phone message history.
+
+Each phone gets a ring buffer of compact ``MessageRecord`` objects capped by
+message count and by total content bytes. Appends and evictions are O(1)
+(amortized for byte eviction) and every record gets a message id from a
+single process-wide counter, so ids never repeat even after old messages
+have been evicted.
+
+Writes take one of ``shards`` locks picked by phone id, so phones never
+contend with each other; reads copy a buffer's deque without locking.
+
+Every appended message is also handed to each of ``journals`` (the
+``EventLog`` and the SQLite ``HistoryStore``), and ``restore`` rebuilds the
+store from an event log replay at startup.
+"""
+import itertools
+import os
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock
+
+DEFAULT_MAX_COUNT = int(os.environ.get('MESSAGE_HISTORY_MAX_COUNT', 500))
+DEFAULT_MAX_BYTES = int(os.environ.get('MESSAGE_HISTORY_MAX_BYTES', 256 * 1024))
+SHARDS = 16
+
+
+class MessageRecord:
+    __slots__ = ('id', 'type', 'content', 'timestamp', 'direction', 'size')
+
+    def __init__(self, message_id, message_type, content, timestamp, direction):
+        self.id = message_id
+        self.type = message_type
+        self.content = content
+        self.timestamp = timestamp
+        self.direction = direction
+        self.size = len(content.encode('utf-8', 'replace')) if isinstance(content, str) else 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'content': self.content,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'direction': self.direction
+        }
+
+
+class PhoneMessageBuffer:
+    """Ring buffer of one phone's most recent messages."""
+
+    __slots__ = ('records', 'total_bytes', 'max_count', 'max_bytes', 'evicted')
+
+    def __init__(self, max_count, max_bytes):
+        self.records = deque()
+        self.total_bytes = 0
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.evicted = 0
+
+    def append(self, record):
+        self.records.append(record)
+        self.total_bytes += record.size
+        while self.records and (len(self.records) > self.max_count or
+                                (self.total_bytes > self.max_bytes and len(self.records) > 1)):
+            old = self.records.popleft()
+            self.total_bytes -= old.size
+            self.evicted += 1
+
+    def __len__(self):
+        return len(self.records)
+
+
+class MessageStore:
+    """Per-phone bounded message history with globally unique message ids."""
+
+    def __init__(self, max_count=DEFAULT_MAX_COUNT, max_bytes=DEFAULT_MAX_BYTES, journals=(), shards=SHARDS):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.journals = list(journals)
+        self._buffers = {}
+        self._ids = itertools.count(1)
+        self._locks = [Lock() for _ in range(shards)]
+
+    def _lock_for(self, phone_id):
+        return self._locks[hash(phone_id) % len(self._locks)]
+
+    def append(self, phone_id, message_type, content, direction, timestamp=None):
+        """Store a message and return its ``MessageRecord``."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock_for(phone_id):
+            record = MessageRecord(next(self._ids), message_type, content, timestamp, direction)
+            self._buffer(phone_id).append(record)
+        if self.journals:
+            event = {
+                'kind': 'message',
+                'phone_id': phone_id,
+                'id': record.id,
+                'type': message_type,
+                'content': content,
+                'direction': direction,
+                'ts': timestamp
+            }
+            for journal in self.journals:
+                journal.append(event)
+        return record
+
+    def restore(self, events):
+        """Load ``message`` events from a journal replay; returns how many.
+
+        Runs at startup, before the store is shared with handlers.
+        """
+        count = 0
+        last_id = 0
+        for event in events:
+            if event.get('kind') != 'message':
+                continue
+            record = MessageRecord(event['id'], event['type'], event['content'], event['ts'], event['direction'])
+            self._buffer(event['phone_id']).append(record)
+            if record.id > last_id:
+                last_id = record.id
+            count += 1
+        self.skip_ids(last_id)
+        return count
+
+    def skip_ids(self, last_id):
+        """Never hand out ids at or below ``last_id`` (e.g. ones already on disk).
+
+        Like ``restore``, only call this during startup.
+        """
+        self._ids = itertools.count(max(next(self._ids), last_id + 1))
+
+    def _buffer(self, phone_id):
+        buffer = self._buffers.get(phone_id)
+        if buffer is None:
+            buffer = self._buffers.setdefault(phone_id, PhoneMessageBuffer(self.max_count, self.max_bytes))
+        return buffer
+
+    def get(self, phone_id, limit=None):
+        """Return the stored messages for ``phone_id``, oldest first."""
+        buffer = self._buffers.get(phone_id)
+        if buffer is None:
+            return []
+        # Copying a deque is a single C call, so it never sees a half-done append.
+        records = list(buffer.records)
+        if limit is not None:
+            records = records[-limit:]
+        return records
+
+    def drop(self, phone_id):
+        with self._lock_for(phone_id):
+            self._buffers.pop(phone_id, None)
+
+    def stats(self):
+        buffers = list(self._buffers.values())
+        return {
+            'phones': len(buffers),
+            'messages': sum(len(b) for b in buffers),
+            'bytes': sum(b.total_bytes for b in buffers),
+            'evicted': sum(b.evicted for b in buffers)
+        }
+
+    def __contains__(self, phone_id):
+        return phone_id in self._buffers
+
+    def __len__(self):
+        return len(self._buffers)
@@ -0,0 +1,227 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain Python numbers updated without any lock:
+under gevent or eventlet a handler is never preempted between the read and
+the write of ``+=``, so updates are exact. In threading mode the GIL can
+switch threads mid-update and, very rarely, an increment is lost, which is
+an acceptable trade for keeping the hot paths lock-free. Labelled children
+are created once and cached in a dict, so the steady-state cost of an
+update is one dict lookup and a couple of additions.
+
+Gauges that mirror existing state (connected phones, queue depths) are
+computed from callbacks at scrape time rather than maintained on every
+change.
+"""
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].value += amount
+
+    def _render_child(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def _render_child(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+        yield f"{self.name}_count{labels} {child.count}"
+
+
+class Gauge(_Metric):
+    """A gauge read from ``collect()`` at scrape time.
+
+    ``collect`` returns a number, or a dict mapping label value tuples to
+    numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        self.collect = collect
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        samples = self.collect()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for values, value in samples.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, collect, labelnames=()):
+        return self._add(Gauge(self.prefix + name, documentation, collect, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedLock:
+    """Wraps a lock and records how long callers wait for it and hold it."""
+
+    def __init__(self, lock, wait, hold):
+        self._lock = lock
+        self._wait = wait
+        self._hold = hold
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self._wait.observe(self._acquired_at - start)
+        return acquired
+
+    def release(self):
+        self._hold.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def count_socket_bytes(eio, bytes_in, bytes_out):
+    """Count the message payload sizes of one Engine.IO server into two counters.
+
+    Only ``eio`` (e.g. ``socketio.server.eio``) is wrapped: every packet it
+    sends goes through its ``send_packet`` (so a broadcast is counted once
+    per recipient) and every message it receives through its ``message``
+    handler. Other Engine.IO servers and clients in the process are left
+    alone. Text is counted in characters, which equals bytes for the ASCII
+    JSON we send.
+    """
+    send_packet, on_message = eio.send_packet, eio.handlers['message']
+
+    def counted_send_packet(sid, pkt):
+        if isinstance(pkt.data, (str, bytes)):
+            bytes_out.inc(len(pkt.data))
+        return send_packet(sid, pkt)
+
+    def counted_message(sid, data):
+        bytes_in.inc(len(data))
+        return on_message(sid, data)
+
+    eio.send_packet = counted_send_packet
+    eio.handlers['message'] = counted_message
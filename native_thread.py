@@ -0,0 +1,21 @@
+"""Real OS threads, locks and sleeps, even under gevent.
+
+The journal and log writers fsync and write to stdout; as greenlets that
+would stall every other greenlet, so they run on the original ``_thread``
+and ``time`` functions that gevent's monkey patching replaces.
+"""
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+
+def _original(module, name):
+    if monkey is not None and monkey.is_module_patched(module):
+        return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+
+start_thread = _original('_thread', 'start_new_thread')
+allocate_lock = _original('_thread', 'allocate_lock')
+sleep = _original('time', 'sleep')
@@ -0,0 +1,186 @@
+"""Per-phone outbound command queues with backpressure.
+
+Each phone gets at most ``max_in_flight`` unanswered commands on the wire;
+anything beyond that waits in a queue of at most ``depth`` commands, and a
+full queue raises ``QueueFull`` so the API can answer 429 instead of piling
+emits into the Socket.IO buffers. A slot whose command is never answered
+is freed after ``in_flight_timeout`` by the phone's next call or by the
+periodic ``sweep``. When ``hold_ttl`` is set, a phone's queue survives a
+disconnect for that many seconds and is flushed when the phone registers
+again.
+
+The queues never emit anything themselves: every call returns the
+``(phone_id, payload)`` pairs that are ready to send, so the caller can emit
+them without holding a lock.
+"""
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+
+QUEUE_DEPTH = int(os.environ.get('COMMAND_QUEUE_DEPTH', 100))
+MAX_IN_FLIGHT = int(os.environ.get('COMMAND_MAX_IN_FLIGHT', 4))
+HOLD_TTL = float(os.environ.get('COMMAND_HOLD_TTL', 60))
+IN_FLIGHT_TIMEOUT = float(os.environ.get('COMMAND_IN_FLIGHT_TIMEOUT', 30))
+SWEEP_INTERVAL = float(os.environ.get('COMMAND_SWEEP_INTERVAL', 1))
+
+
+class QueueFull(Exception):
+
+    def __init__(self, phone_id, retry_after):
+        super().__init__(f"command queue for {phone_id} is full")
+        self.phone_id = phone_id
+        self.retry_after = retry_after
+
+
+class PhoneQueue:
+    __slots__ = ('waiting', 'in_flight', 'online')
+
+    def __init__(self):
+        self.waiting = deque()
+        self.in_flight = OrderedDict()
+        self.online = True
+
+
+class OutboundQueues:
+
+    def __init__(self, depth=QUEUE_DEPTH, max_in_flight=MAX_IN_FLIGHT, hold_ttl=HOLD_TTL,
+                 in_flight_timeout=IN_FLIGHT_TIMEOUT):
+        self.depth = depth
+        self.max_in_flight = max_in_flight
+        self.hold_ttl = hold_ttl
+        self.in_flight_timeout = in_flight_timeout
+        self._queues = {}
+        self._offline = OrderedDict()
+        self._lock = Lock()
+        self.rejected = 0
+
+    def submit(self, phone_id, correlation_id, payload, online):
+        """Queue a command; returns ``(status, ready)``.
+
+        ``status`` is ``'sent'`` or ``'queued'``, or ``None`` when the phone
+        is offline and not being held for. Raises ``QueueFull`` when the
+        phone's queue is at ``depth``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire_offline(now)
+            queue = self._queues.get(phone_id)
+            if queue is None:
+                if not online:
+                    return None, []
+                queue = self._queues[phone_id] = PhoneQueue()
+            elif not online and queue.online:
+                return None, []
+            elif online:
+                queue.online = True
+            self._expire_in_flight(queue, now)
+            if len(queue.waiting) >= self.depth:
+                self.rejected += 1
+                raise QueueFull(phone_id, self._retry_after(queue, now))
+            queue.waiting.append((correlation_id, payload))
+            ready = self._pump(phone_id, queue, now)
+            status = 'sent' if any(item[1] is payload for item in ready) else 'queued'
+            return status, ready
+
+    def complete(self, phone_id, correlation_id):
+        """Free the in-flight slot of ``correlation_id``.
+
+        Ids that aren't in flight here (late responses, commands sent around
+        the queue, ``None``) leave every slot alone; a slot whose answer
+        never comes is freed by the in-flight timeout instead.
+        """
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(phone_id)
+            if queue is None or not queue.online:
+                return []
+            self._expire_in_flight(queue, now)
+            queue.in_flight.pop(correlation_id, None)
+            return self._pump(phone_id, queue, now)
+
+    def sweep(self):
+        """Expire timed-out slots of every phone with commands waiting; returns what that lets out."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            self._expire_offline(now)
+            for phone_id, queue in self._queues.items():
+                if queue.waiting and queue.in_flight:
+                    self._expire_in_flight(queue, now)
+                    ready.extend(self._pump(phone_id, queue, now))
+        return ready
+
+    def connected(self, phone_id):
+        """A phone (re)registered: flush whatever was held for it."""
+        now = time.monotonic()
+        with self._lock:
+            self._offline.pop(phone_id, None)
+            queue = self._queues.get(phone_id)
+            if queue is None:
+                self._queues[phone_id] = PhoneQueue()
+                return []
+            queue.online = True
+            queue.in_flight.clear()
+            return self._pump(phone_id, queue, now)
+
+    def disconnected(self, phone_id):
+        """A phone went away: hold its queue for ``hold_ttl`` or drop it."""
+        with self._lock:
+            queue = self._queues.get(phone_id)
+            if queue is None:
+                return
+            if self.hold_ttl <= 0:
+                del self._queues[phone_id]
+                return
+            queue.online = False
+            queue.in_flight.clear()
+            self._offline[phone_id] = time.monotonic()
+
+    def stats(self, phone_id=None):
+        with self._lock:
+            if phone_id is not None:
+                queue = self._queues.get(phone_id)
+                if queue is None:
+                    return None
+                return {'waiting': len(queue.waiting), 'in_flight': len(queue.in_flight),
+                        'online': queue.online}
+            return {
+                'phones': len(self._queues),
+                'held_offline': len(self._offline),
+                'waiting': sum(len(q.waiting) for q in self._queues.values()),
+                'in_flight': sum(len(q.in_flight) for q in self._queues.values()),
+                'rejected': self.rejected
+            }
+
+    def _pump(self, phone_id, queue, now):
+        ready = []
+        if not queue.online:
+            return ready
+        while queue.waiting and len(queue.in_flight) < self.max_in_flight:
+            correlation_id, payload = queue.waiting.popleft()
+            queue.in_flight[correlation_id] = now
+            ready.append((phone_id, payload))
+        return ready
+
+    def _expire_in_flight(self, queue, now):
+        # Phones that never answer must not wedge their queue forever.
+        cutoff = now - self.in_flight_timeout
+        while queue.in_flight and next(iter(queue.in_flight.values())) < cutoff:
+            queue.in_flight.popitem(last=False)
+
+    def _expire_offline(self, now):
+        cutoff = now - self.hold_ttl
+        while self._offline:
+            phone_id, since = next(iter(self._offline.items()))
+            if since >= cutoff:
+                break
+            del self._offline[phone_id]
+            self._queues.pop(phone_id, None)
+
+    def _retry_after(self, queue, now):
+        if queue.in_flight:
+            oldest = next(iter(queue.in_flight.values()))
+            return max(1, math.ceil(oldest + self.in_flight_timeout - now))
+        return 1
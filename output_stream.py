@@ -0,0 +1,133 @@
+"""Streamed command output.
+
+A command sent with ``stream`` asks the device to return its output as
+``command_output`` chunks ``{correlation_id, seq, data, done}`` instead of
+one ``message_response``. The server relays every chunk to dashboards as
+it arrives and never joins them, unless the caller asked to keep the
+output; kept output is capped at ``keep_max_bytes`` and marked truncated
+beyond that.
+
+Chunks are relayed in ``seq`` order. A chunk that arrives early waits in a
+small reorder window; duplicates and chunks for unknown or finished streams
+are dropped. Like ``OutboundQueues`` this class never emits: ``chunk``
+returns the chunks that are ready to relay.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+KEEP_MAX_BYTES = int(os.environ.get('STREAM_KEEP_MAX_BYTES', 1024 * 1024))
+IDLE_TIMEOUT = float(os.environ.get('STREAM_IDLE_TIMEOUT', 120))
+REORDER_WINDOW = 64
+
+
+class OutputStream:
+    __slots__ = ('correlation_id', 'phone_id', 'keep', 'next_seq', 'early', 'kept', 'kept_bytes',
+                 'bytes', 'chunks', 'truncated', 'done', 'last_activity')
+
+    def __init__(self, correlation_id, phone_id, keep, now):
+        self.correlation_id = correlation_id
+        self.phone_id = phone_id
+        self.keep = keep
+        self.next_seq = 0
+        self.early = {}
+        self.kept = []
+        self.kept_bytes = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.truncated = False
+        self.done = False
+        self.last_activity = now
+
+    def output(self):
+        """The kept output, or ``None`` if it wasn't kept."""
+        return ''.join(self.kept) if self.keep else None
+
+    def summary(self):
+        return {'bytes': self.bytes, 'chunks': self.chunks, 'truncated': self.truncated}
+
+
+class OutputStreams:
+
+    def __init__(self, keep_max_bytes=KEEP_MAX_BYTES, idle_timeout=IDLE_TIMEOUT, reorder_window=REORDER_WINDOW):
+        self.keep_max_bytes = keep_max_bytes
+        self.idle_timeout = idle_timeout
+        self.reorder_window = reorder_window
+        self._streams = OrderedDict()
+        self._lock = Lock()
+        self.dropped = 0
+
+    def open(self, correlation_id, phone_id, keep=False):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._streams[correlation_id] = OutputStream(correlation_id, phone_id, keep, now)
+
+    def chunk(self, correlation_id, seq, data, done=False):
+        """Accept one chunk; returns ``(stream, ready)``.
+
+        ``ready`` lists ``(seq, data, done)`` tuples to relay, in order.
+        ``stream`` is ``None`` for unknown streams; once a ``done`` chunk has
+        been relayed, ``stream.done`` is set and the stream is closed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stream = self._streams.get(correlation_id)
+            if stream is None:
+                self.dropped += 1
+                return None, []
+            stream.last_activity = now
+            self._streams.move_to_end(correlation_id)
+            if seq < stream.next_seq or seq in stream.early:
+                self.dropped += 1
+                return stream, []
+            if seq > stream.next_seq:
+                if len(stream.early) >= self.reorder_window:
+                    self.dropped += 1
+                else:
+                    stream.early[seq] = (data, done)
+                return stream, []
+            ready = []
+            while True:
+                self._accept(stream, data)
+                ready.append((stream.next_seq, data, done))
+                stream.next_seq += 1
+                if done or stream.next_seq not in stream.early:
+                    break
+                data, done = stream.early.pop(stream.next_seq)
+            if done:
+                stream.done = True
+                del self._streams[correlation_id]
+            return stream, ready
+
+    def close(self, correlation_id):
+        with self._lock:
+            return self._streams.pop(correlation_id, None)
+
+    def __contains__(self, correlation_id):
+        return correlation_id in self._streams
+
+    def __len__(self):
+        return len(self._streams)
+
+    def _accept(self, stream, data):
+        size = len(data)
+        stream.bytes += size
+        stream.chunks += 1
+        if not stream.keep or stream.truncated:
+            return
+        room = self.keep_max_bytes - stream.kept_bytes
+        if size > room:
+            data = data[:room]
+            stream.truncated = True
+        stream.kept.append(data)
+        stream.kept_bytes += len(data)
+
+    def _expire(self, now):
+        cutoff = now - self.idle_timeout
+        while self._streams:
+            correlation_id, stream = next(iter(self._streams.items()))
+            if stream.last_activity >= cutoff:
+                break
+            del self._streams[correlation_id]
@@ -0,0 +1,250 @@
+"""Versioned registry of connected devices.
+
+Every change to the registry bumps a sequence number and appends a delta
+(``add``, ``update`` or ``remove``) to a bounded log. Dashboards apply the
+deltas pushed over Socket.IO and resync with ``deltas_since`` when they
+notice a gap, falling back to a full snapshot when the gap is older than
+the log.
+
+Phones are spread over ``shards`` by phone id. Each shard's map is copied
+on write and swapped in whole, so lookups, iteration and ``select`` read
+the current maps without taking any lock, and writers only serialize with
+other writers on the same shard. The sequence number and delta log are the
+one shared point; their lock is held just long enough to append a delta.
+``last_seen`` changes on every message, so it lives in a per-shard map of
+its own instead of in the records, and refreshing it never copies a map.
+
+A reverse ``sid -> phone ids`` index, sharded by sid, lets a socket
+disconnect resolve its phones in O(1) instead of scanning the fleet. The
+index may briefly name phones that already moved to another socket;
+removals always re-check the phone's current sid.
+"""
+import os
+from collections import deque
+from datetime import datetime
+from threading import Lock
+
+DELTA_LOG_SIZE = 1024
+SHARDS = int(os.environ.get('REGISTRY_SHARDS', 16))
+
+
+class _Shard:
+    __slots__ = ('phones', 'last_seen', 'lock')
+
+    def __init__(self, lock):
+        self.phones = {}
+        self.last_seen = {}
+        self.lock = lock
+
+
+class _SidShard:
+    __slots__ = ('phone_ids', 'lock')
+
+    def __init__(self, lock):
+        self.phone_ids = {}
+        self.lock = lock
+
+
+class DeviceRegistry:
+
+    def __init__(self, delta_log_size=DELTA_LOG_SIZE, shards=SHARDS, lock=Lock):
+        """``lock`` is the factory for the per-shard locks (e.g. an instrumented lock)."""
+        self._shards = [_Shard(lock()) for _ in range(shards)]
+        self._sid_shards = [_SidShard(lock()) for _ in range(shards)]
+        self._deltas = deque(maxlen=delta_log_size)
+        self._delta_lock = Lock()
+        self.version = 0
+
+    def _shard(self, phone_id):
+        return self._shards[hash(phone_id) % len(self._shards)]
+
+    def _sid_shard(self, sid):
+        return self._sid_shards[hash(sid) % len(self._sid_shards)]
+
+    @staticmethod
+    def _public(phone_id, record):
+        return {
+            'id': phone_id,
+            'tags': sorted(record['tags']),
+            'status': record['status'],
+            'connected_at': record['connected_at'].isoformat()
+        }
+
+    def _record_delta(self, op, phone_id, record=None):
+        delta = {'op': op, 'phone_id': phone_id}
+        if record is not None:
+            delta['phone'] = self._public(phone_id, record)
+        with self._delta_lock:
+            self.version += 1
+            delta['seq'] = self.version
+            self._deltas.append(delta)
+        return delta
+
+    def register(self, phone_id, sid, worker=None, tags=(), encoding='json'):
+        """Add or refresh a phone and return the resulting delta.
+
+        ``worker`` names the process holding the phone's socket in
+        multi-worker mode; ``tags`` are free-form labels used to select
+        groups of phones for bulk commands; ``encoding`` is the wire
+        encoding negotiated with the device.
+        """
+        now = datetime.now()
+        record = {
+            'sid': sid,
+            'worker': worker,
+            'tags': frozenset(tags),
+            'encoding': encoding,
+            'status': 'online',
+            'connected_at': now
+        }
+        self._index_sid(sid, phone_id)
+        shard = self._shard(phone_id)
+        with shard.lock:
+            previous = shard.phones.get(phone_id)
+            phones = dict(shard.phones)
+            phones[phone_id] = record
+            shard.phones = phones
+            shard.last_seen[phone_id] = now
+            delta = self._record_delta('update' if previous else 'add', phone_id, record)
+        if previous and previous['sid'] != sid:
+            self._unindex_sid(previous['sid'], phone_id)
+        return delta
+
+    def touch(self, phone_id, now=None):
+        """Refresh ``last_seen``; produces no delta and leaves the record alone."""
+        shard = self._shard(phone_id)
+        with shard.lock:
+            if phone_id in shard.phones:
+                shard.last_seen[phone_id] = now or datetime.now()
+
+    def last_seen(self, phone_id):
+        return self._shard(phone_id).last_seen.get(phone_id)
+
+    def set_status(self, phone_id, status):
+        """Set a phone's liveness status; returns the delta, or ``None`` if nothing changed."""
+        shard = self._shard(phone_id)
+        with shard.lock:
+            record = shard.phones.get(phone_id)
+            if record is None or record['status'] == status:
+                return None
+            phones = dict(shard.phones)
+            record = phones[phone_id] = dict(record, status=status)
+            shard.phones = phones
+            return self._record_delta('update', phone_id, record)
+
+    def remove(self, phone_id, sid=None):
+        """Remove a phone and return the delta, or ``None`` if it was unknown.
+
+        With ``sid`` the phone is only removed if it is still registered on
+        that socket, so a stale removal can't undo a newer registration.
+        """
+        shard = self._shard(phone_id)
+        with shard.lock:
+            record = shard.phones.get(phone_id)
+            if record is None or (sid is not None and record['sid'] != sid):
+                return None
+            phones = dict(shard.phones)
+            del phones[phone_id]
+            shard.phones = phones
+            del shard.last_seen[phone_id]
+            delta = self._record_delta('remove', phone_id)
+        self._unindex_sid(record['sid'], phone_id)
+        return delta
+
+    def remove_sid(self, sid):
+        """Remove every phone registered on ``sid`` and return their deltas."""
+        sid_shard = self._sid_shard(sid)
+        with sid_shard.lock:
+            phone_ids = sid_shard.phone_ids.pop(sid, ())
+        deltas = []
+        for phone_id in phone_ids:
+            delta = self.remove(phone_id, sid)
+            if delta is not None:
+                deltas.append(delta)
+        return deltas
+
+    def remove_worker(self, worker):
+        """Remove every phone held by ``worker`` and return their deltas."""
+        deltas = []
+        for phone_id, record in self.items():
+            if record['worker'] == worker:
+                delta = self.remove(phone_id, record['sid'])
+                if delta is not None:
+                    deltas.append(delta)
+        return deltas
+
+    def select(self, phone_ids=None, tag=None):
+        """Resolve a bulk target to ``([(phone_id, sid), ...], missing_ids)``.
+
+        Pass ``phone_ids`` for an explicit list, ``tag`` for every phone
+        carrying that tag, or neither for the whole fleet.
+        """
+        if phone_ids is not None:
+            found, missing = [], []
+            for phone_id in phone_ids:
+                record = self.get(phone_id)
+                if record is None:
+                    missing.append(phone_id)
+                else:
+                    found.append((phone_id, record['sid']))
+            return found, missing
+        return [(pid, rec['sid']) for pid, rec in self.items()
+                if tag is None or tag in rec['tags']], []
+
+    def phones_for_sid(self, sid):
+        return [pid for pid in list(self._sid_shard(sid).phone_ids.get(sid, ()))
+                if (self.get(pid) or {}).get('sid') == sid]
+
+    def _index_sid(self, sid, phone_id):
+        sid_shard = self._sid_shard(sid)
+        with sid_shard.lock:
+            sid_shard.phone_ids.setdefault(sid, set()).add(phone_id)
+
+    def _unindex_sid(self, sid, phone_id):
+        sid_shard = self._sid_shard(sid)
+        with sid_shard.lock:
+            phone_ids = sid_shard.phone_ids.get(sid)
+            if phone_ids is not None:
+                phone_ids.discard(phone_id)
+                if not phone_ids:
+                    del sid_shard.phone_ids[sid]
+
+    def snapshot(self):
+        # Read the version first: a change racing with the copy shows up both
+        # in the snapshot and as a delta, and applying a delta twice is a no-op.
+        version = self.version
+        return {
+            'version': version,
+            'full': True,
+            'phones': [self._public(pid, rec) for pid, rec in self.items()]
+        }
+
+    def deltas_since(self, version):
+        """Deltas after ``version``, or a full snapshot if they were trimmed."""
+        with self._delta_lock:
+            current = self.version
+            deltas = list(self._deltas)
+        if version == current:
+            return {'version': current, 'full': False, 'deltas': []}
+        oldest = deltas[0]['seq'] if deltas else current + 1
+        if 0 <= version < current and version + 1 >= oldest:
+            return {'version': current, 'full': False, 'deltas': [d for d in deltas if d['seq'] > version]}
+        return self.snapshot()
+
+    def get(self, phone_id):
+        return self._shard(phone_id).phones.get(phone_id)
+
+    def items(self):
+        return [item for shard in self._shards for item in shard.phones.items()]
+
+    def keys(self):
+        return [phone_id for shard in self._shards for phone_id in shard.phones]
+
+    def __contains__(self, phone_id):
+        return phone_id in self._shard(phone_id).phones
+
+    def __getitem__(self, phone_id):
+        return self._shard(phone_id).phones[phone_id]
+
+    def __len__(self):
+        return sum(len(shard.phones) for shard in self._shards)
@@ -1,21 +1,211 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template_string, request, jsonify
-from flask_socketio import SocketIO
-import json
 import os
+
+# The async server has to patch the stdlib before anything else imports
+# socket/threading. ASYNC_MODE=auto uses gevent when it is installed.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'auto')
+if ASYNC_MODE == 'auto':
+    try:
+        import gevent
+        ASYNC_MODE = 'gevent'
+    except ImportError:
+        ASYNC_MODE = 'threading'
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, request, jsonify, send_file
+from flask_socketio import SocketIO, join_room, leave_room
+import gzip
+import hashlib
+import functools
+import json
+import queue
+import resource
 from datetime import datetime
 from threading import Lock
 import time
+import uuid
+import zlib
+
+from cluster import BusManager, Cluster, HubClient
+from command_tracker import CommandTracker
+from dashboard_outbox import DashboardOutbox, OutboxManager, with_outbox
+from event_log import EventLog
+from history_store import HistoryStore
+from liveness import BUCKET_SECONDS, HEARTBEAT_INTERVAL, LivenessTracker
+from message_store import MessageStore
+from metrics import InstrumentedLock, MetricsRegistry, count_socket_bytes
+from outbound_queue import SWEEP_INTERVAL as OUTBOUND_SWEEP_INTERVAL, OutboundQueues, QueueFull
+from output_stream import OutputStreams
+from registry import DeviceRegistry
+from structured_log import StructuredLogger
+from transfer import TransferError, TransferLimit, TransferManager
+from ussd import REAP_INTERVAL, CampaignManager, MenuCache, UssdSessionManager
+import wire
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON lines on stdout, written by a background thread. Per-socket chatter
+# is debug and per-command events are sampled unless LOG_LEVELS/LOG_SAMPLE
+# say otherwise.
+log = StructuredLogger.from_env(
+    event_levels={'socket_connected': 'debug', 'command_dispatched': 'debug', 'command_response': 'debug'},
+    sample={'command_dispatched': 100, 'command_response': 100})
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# Multi-worker mode: CLUSTER_HUB=host:port points at the hub started by
+# cluster.py. Emits and registry changes are then shared between workers.
+WORKER_ID = os.environ.get('WORKER_ID') or uuid.uuid4().hex[:8]
+CLUSTER_HUB = os.environ.get('CLUSTER_HUB')
+bus = None
+if CLUSTER_HUB:
+    bus = HubClient(CLUSTER_HUB, WORKER_ID)
+    client_manager = with_outbox(BusManager)(bus)
+else:
+    client_manager = OutboxManager()
+
+# Per-phone dashboard events are queued per dashboard socket and sent as one
+# event_batch every DASHBOARD_BATCH_INTERVAL seconds (0 sends them directly).
+dashboard_outbox = DashboardOutbox()
+if dashboard_outbox.interval > 0:
+    client_manager.outbox = dashboard_outbox
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, client_manager=client_manager)
+
+# Metrics for /metrics. Handler counters and histograms are updated without
+# locks; everything mirroring existing state is read at scrape time.
+metrics = MetricsRegistry('phone_controller_')
 
 # Store connected phones and messages
-connected_phones = {}
-phone_messages = {}
-phone_lock = Lock()
-ussd_sessions = {}  # Store active USSD sessions
+registry_lock_wait = metrics.histogram('registry_lock_wait_seconds', 'Time spent waiting for a registry shard lock.')
+registry_lock_hold = metrics.histogram('registry_lock_hold_seconds', 'Time a registry shard lock was held.')
+connected_phones = DeviceRegistry(lock=lambda: InstrumentedLock(Lock(), registry_lock_wait, registry_lock_hold))
+
+# Message, command and USSD history is journaled to disk and replayed on
+# start. Set EVENT_LOG_DIR to an empty string to keep history in memory only.
+EVENT_LOG_DIR = os.environ.get('EVENT_LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'events'))
+if EVENT_LOG_DIR and CLUSTER_HUB:
+    EVENT_LOG_DIR = os.path.join(EVENT_LOG_DIR, WORKER_ID)
+event_log = EventLog(EVENT_LOG_DIR) if EVENT_LOG_DIR else None
+phone_messages = MessageStore()
+if event_log:
+    replay_started = time.perf_counter()
+    replayed = phone_messages.restore(event_log.replay_tail(phone_messages.max_count))
+    log.info('event_log_replayed', events=replayed, seconds=round(time.perf_counter() - replay_started, 3))
+    phone_messages.journals.append(event_log)
+
+# Full, pageable message history. Set HISTORY_DB to an empty string to page
+# through the in-memory buffers instead.
+HISTORY_DB = os.environ.get('HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history.db'))
+if HISTORY_DB and CLUSTER_HUB:
+    HISTORY_DB = f"{os.path.splitext(HISTORY_DB)[0]}-{WORKER_ID}.db"
+history_store = HistoryStore(HISTORY_DB) if HISTORY_DB else None
+if history_store:
+    phone_messages.skip_ids(history_store.last_id())
+    phone_messages.journals.append(history_store)
+command_tracker = CommandTracker()
+outbound_queues = OutboundQueues()
+outbound_sweeper_started = False
+output_streams = OutputStreams()
+transfers = TransferManager()
+TRANSFER_PROGRESS_INTERVAL = float(os.environ.get('TRANSFER_PROGRESS_INTERVAL', 1))
+ussd_sessions = UssdSessionManager()
+ussd_reaper_started = False
+liveness = LivenessTracker()
+liveness_sweeper_started = False
+dashboard_outbox_flusher_started = False
+ussd_campaigns = CampaignManager()
+ussd_menus = MenuCache()
+USSD_CAMPAIGN_CONCURRENCY = int(os.environ.get('USSD_CAMPAIGN_CONCURRENCY', 50))
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 100))
+
+# Socket.IO rooms: dashboards get registry deltas, devices get device-wide
+# broadcasts, and per-phone events go to the firehose room plus the
+# subscription room for that phone.
+DASHBOARD_ROOM = 'dashboards'
+DEVICE_ROOM = 'devices'
+FIREHOSE_ROOM = 'dashboards:all'
+client_manager.dashboard_room = DASHBOARD_ROOM
+
+def phone_room(phone_id):
+    return f"dashboards:phone:{phone_id}"
+
+def phone_audience(phone_id):
+    return [FIREHOSE_ROOM, phone_room(phone_id)]
+
+def emit_phone_delta(delta):
+    # Every worker numbers its own registry changes, so deltas only go to the
+    # dashboards connected to this worker.
+    socketio.emit('phone_delta', delta, to=DASHBOARD_ROOM, ignore_queue=True)
+
+cluster = Cluster(bus, connected_phones, WORKER_ID, on_delta=emit_phone_delta) if bus else None
+if cluster:
+    cluster.start()
+
+handler_calls = metrics.counter('handler_calls_total', 'Socket.IO events and API calls handled.', ['handler'])
+handler_errors = metrics.counter('handler_errors_total', 'Handlers that raised.', ['handler'])
+handler_seconds = metrics.histogram('handler_duration_seconds', 'Handler run time.', ['handler'])
+commands_rejected = metrics.counter('commands_rejected_total', 'Commands refused because the queue was full.')
+transfer_bytes = metrics.counter('transfer_bytes_total', 'File transfer payload bytes moved.', ['direction'])
+count_socket_bytes(socketio.server.eio,
+                   metrics.counter('socket_bytes_received_total', 'Engine.IO payload bytes received.'),
+                   metrics.counter('socket_bytes_sent_total', 'Engine.IO payload bytes sent.'))
+
+def _count_devices():
+    counts = {('local',): 0, ('remote',): 0}
+    for _, record in connected_phones.items():
+        counts[('local',) if record['worker'] in (None, WORKER_ID) else ('remote',)] += 1
+    return counts
+
+metrics.gauge('connected_devices', 'Registered phones, by whether this worker owns the socket.',
+              _count_devices, ['worker'])
+def _queue_depth():
+    stats = outbound_queues.stats()
+    return {('waiting',): stats['waiting'], ('in_flight',): stats['in_flight']}
+
+metrics.gauge('command_queue_depth', 'Outbound commands per state across all phones.', _queue_depth, ['state'])
+metrics.gauge('commands_pending', 'Dispatched commands without a response yet.', command_tracker.pending_count)
+metrics.gauge('ussd_sessions_active', 'Open USSD sessions.', lambda: len(ussd_sessions))
+metrics.gauge('transfers_active', 'File transfers in progress.', lambda: len(transfers))
+metrics.gauge('dashboard_events_coalesced', 'Dashboard events merged into another or suppressed by the rate limit.',
+              lambda: {('merged',): dashboard_outbox.merged, ('suppressed',): dashboard_outbox.suppressed},
+              ['reason'])
+metrics.gauge('log_records_dropped', 'Log records dropped because the log queue was full.', lambda: log.dropped)
+
+def timed(name):
+    """Count calls, errors and run time of a handler under ``name``."""
+    calls, errors, seconds = handler_calls.labels(name), handler_errors.labels(name), handler_seconds.labels(name)
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            calls.inc()
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def device_event(handler):
+    """Decode msgpack payloads from devices that negotiated the compact encoding."""
+    @functools.wraps(handler)
+    def wrapper(data=None):
+        if isinstance(data, (bytes, bytearray)):
+            data = wire.decode(data)
+        return handler(data)
+    return wrapper
 
 # Modern Dark UI with Complete CSS + USSD Features
 HTML_TEMPLATE = """
@@ -210,6 +400,11 @@ HTML_TEMPLATE = """
             background: linear-gradient(135deg, #1a1a1a, #2a2a2a);
         }
 
+        .device-card.stale {
+            border-left-color: var(--neon-orange);
+            opacity: 0.75;
+        }
+
         .device-card.offline:hover {
             transform: none;
             box-shadow: none;
@@ -248,6 +443,11 @@ HTML_TEMPLATE = """
             color: var(--text);
         }
 
+        .status-stale {
+            background: var(--neon-orange);
+            color: var(--dark-bg);
+        }
+
         .stats {
             display: grid;
             grid-template-columns: 1fr 1fr;
@@ -631,6 +831,44 @@ HTML_TEMPLATE = """
             color: var(--neon-green);
         }
 
+        .virtual-list {
+            display: block;
+            position: relative;
+            overflow-x: hidden;
+            overflow-y: auto;
+        }
+
+        .device-list.virtual-list {
+            max-height: 60vh;
+        }
+
+        .virtual-spacer {
+            position: relative;
+        }
+
+        .virtual-spacer > * {
+            position: absolute;
+            left: 0;
+            right: 0;
+        }
+
+        .virtual-spacer > .message {
+            animation: none;
+        }
+
+        .virtual-spacer .message-content {
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
+        }
+
+        .stream-output {
+            margin: 0;
+            font: inherit;
+            white-space: pre-wrap;
+            word-break: break-all;
+        }
+
         .notification {
             position: fixed;
             top: 30px;
@@ -1257,15 +1495,23 @@ HTML_TEMPLATE = """
     <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
     <script>
         const socket = io();
-        let phones = [];
+        // Insertion-ordered phone id -> status
+        const phones = new Map();
         let commandCount = 0;
         let selectedPhone = '';
         let activeUSSD = null;
+        let registryVersion = -1;
+        const ussdMenus = {};
+        let resyncing = false;
+        // Deltas that arrive while a resync is in flight
+        let pendingDeltas = [];
         
         // Socket events
         socket.on('connect', function() {
             showNotification('Connected to server', 'success');
             updateConnectionStatus(true);
+            socket.emit('join_dashboard', {});
+            resyncPhones();
         });
         
         socket.on('disconnect', function() {
@@ -1273,17 +1519,121 @@ HTML_TEMPLATE = """
             showNotification('Disconnected from server', 'danger');
         });
         
-        socket.on('phone_list_update', function(phoneList) {
-            phones = phoneList;
+        socket.on('phone_delta', receivePhoneDelta);
+        
+        function receivePhoneDelta(delta) {
+            if (resyncing) {
+                pendingDeltas.push(delta);
+                return;
+            }
+            if (delta.seq <= registryVersion) return;
+            if (delta.seq !== registryVersion + 1) {
+                resyncPhones();
+                return;
+            }
+            applyPhoneDelta(delta);
+            registryVersion = delta.seq;
             updatePhoneDisplay();
-        });
+        }
+        
+        // Device registry sync
+        function applyPhoneDelta(delta) {
+            if (delta.op === 'remove') {
+                phoneOptionsDirty = phones.delete(delta.phone_id) || phoneOptionsDirty;
+            } else {
+                phoneOptionsDirty = phoneOptionsDirty || !phones.has(delta.phone_id);
+                phones.set(delta.phone_id, delta.phone.status);
+            }
+        }
+        
+        function resyncPhones() {
+            resyncing = true;
+            fetch(`/api/phones?since=${registryVersion}`)
+                .then(response => response.json())
+                .then(result => {
+                    if (result.full) {
+                        phones.clear();
+                        result.phones.forEach(phone => phones.set(phone.id, phone.status));
+                        phoneOptionsDirty = true;
+                    } else {
+                        result.deltas.forEach(applyPhoneDelta);
+                    }
+                    registryVersion = result.version;
+                    updatePhoneDisplay();
+                })
+                .finally(() => {
+                    resyncing = false;
+                    // Replay what arrived meanwhile; ones the resync already covers are skipped.
+                    const queued = pendingDeltas.sort((a, b) => a.seq - b.seq);
+                    pendingDeltas = [];
+                    queued.forEach(receivePhoneDelta);
+                });
+        }
+        
+        // Per-phone events are queued and handled together once per
+        // animation frame, so a burst costs one layout instead of one per
+        // event. The server may also send them pre-batched as event_batch.
+        const eventHandlers = {
+            new_message: function(data) {
+                addMessageToPanel(data.phone_id, data.message, data.timestamp);
+            },
+            command_response: function(data) {
+                if (data.streamed) {
+                    addToLiveFeed(`> ${data.phone_id}: [stream finished: ${data.bytes} chars in ${data.chunks} chunks]`);
+                    return;
+                }
+                addToLiveFeed(`> ${data.phone_id}: ${data.response}`);
+            },
+            command_output: function(data) {
+                appendStreamChunk(data);
+            },
+            message_response: function(data) {
+                // A new_message + command_response pair merged by the server
+                addMessageToPanel(data.phone_id, `${data.type.toUpperCase()}: ${data.response}`, data.timestamp);
+                eventHandlers.command_response(data);
+            },
+            bulk_dispatch: function(data) {
+                addMessageToPanel(`${data.phone_ids.length} devices`, `Bulk command: ${data.command}`, data.timestamp);
+            },
+            events_suppressed: function(data) {
+                const devices = Object.keys(data.phones).length;
+                addToLiveFeed(`> [${data.total} events from ${devices} devices suppressed by the server]`);
+            },
+            transfer_progress: function(data) {
+                if (data.status === 'active') return;
+                const arrow = data.direction === 'upload' ? 'from' : 'to';
+                addToLiveFeed(`> ${data.phone_id}: ${data.name} ${arrow} device ${data.status} (${data.received} bytes)`);
+            }
+        };
+        let eventQueue = [];
+        let eventFrame = null;
         
-        socket.on('new_message', function(data) {
-            addMessageToPanel(data.phone_id, data.message, data.timestamp);
+        function queueEvent(event, data) {
+            eventQueue.push([event, data]);
+            scheduleEventFlush();
+        }
+        
+        function scheduleEventFlush() {
+            if (eventFrame === null) eventFrame = requestAnimationFrame(flushEvents);
+        }
+        
+        function flushEvents() {
+            eventFrame = null;
+            const events = eventQueue;
+            eventQueue = [];
+            events.forEach(([event, data]) => eventHandlers[event](data));
+            flushLiveFeed();
+        }
+        
+        Object.keys(eventHandlers).forEach(event => {
+            socket.on(event, data => queueEvent(event, data));
         });
         
-        socket.on('command_response', function(data) {
-            addToLiveFeed(`> ${data.phone_id}: ${data.response}`);
+        socket.on('event_batch', function(events) {
+            events.forEach(([event, data]) => {
+                if (eventHandlers[event]) eventQueue.push([event, data]);
+            });
+            scheduleEventFlush();
         });
         
         // USSD Events
@@ -1293,6 +1643,23 @@ HTML_TEMPLATE = """
         });
         
         socket.on('ussd_update', function(data) {
+            if (data.menu === undefined) {
+                const cached = ussdMenus[data.menu_ref];
+                if (cached) {
+                    updateUSSDDisplay({...data, menu: cached.menu});
+                } else {
+                    fetch(`/api/ussd/menus/ref/${data.menu_ref}`)
+                        .then(response => response.ok ? response.json() : null)
+                        .then(node => {
+                            // An evicted menu leaves the text the device sent
+                            if (!node) return updateUSSDDisplay(data);
+                            ussdMenus[node.ref] = {text: node.text, menu: node};
+                            updateUSSDDisplay({...data, menu: node});
+                        });
+                }
+                return;
+            }
+            ussdMenus[data.menu_ref] = {text: data.response, menu: data.menu};
             updateUSSDDisplay(data);
         });
         
@@ -1300,53 +1667,80 @@ HTML_TEMPLATE = """
             endUSSDInterface(data);
         });
         
+        socket.on('ussd_error', function(data) {
+            showNotification(`USSD on ${data.phone_id}: ${data.error}`, 'danger');
+        });
+        
         // UI Functions
         function switchTab(tabName) {
             document.querySelectorAll('.tab-content').forEach(tab => tab.classList.remove('active'));
             document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
             document.getElementById(tabName).classList.add('active');
             event.target.classList.add('active');
+            // A hidden list has no height; lay it out now that it shows
+            if (tabName === 'messages') messageView.invalidate();
         }
         
+        // The device list, device picker and counters are redrawn at most
+        // once per animation frame, however many deltas arrive in between.
+        let phoneFrame = null;
+        let phoneOptionsDirty = false;
+        const phoneOptions = new Map();
+        
         function updatePhoneDisplay() {
-            const phoneList = document.getElementById('phoneList');
-            const phoneSelect = document.getElementById('phoneSelect');
-            
-            document.getElementById('connectedCount').textContent = phones.length;
+            if (phoneFrame === null) phoneFrame = requestAnimationFrame(renderPhones);
+        }
+        
+        function renderPhones() {
+            phoneFrame = null;
+            document.getElementById('connectedCount').textContent = phones.size;
             document.getElementById('totalCommands').textContent = commandCount;
-            
-            if (phones.length === 0) {
-                phoneList.innerHTML = `
-                    <div class="device-card offline">
-                        <div class="device-info">
-                            <div class="device-name">No devices connected</div>
-                            <div class="device-status status-offline">OFFLINE</div>
-                        </div>
-                    </div>`;
-            } else {
-                phoneList.innerHTML = phones.map(phone => `
-                    <div class="device-card ${selectedPhone === phone ? 'selected' : ''}" onclick="selectPhone('${phone}')">
-                        <div class="device-info">
-                            <div class="device-name">${phone}</div>
-                            <div class="device-status status-online">ONLINE</div>
-                        </div>
-                    </div>`).join('');
+            if (phoneOptionsDirty) syncPhoneOptions();
+            if (!phones.has(selectedPhone)) {
+                // Auto-select the first device, or clear a selection that went away
+                selectPhone(phones.size ? phones.keys().next().value : '');
             }
-            
-            const currentSelected = phoneSelect.value;
-            const options = '<option value="">-- SELECT DEVICE --</option>' + 
-                phones.map(phone => `<option value="${phone}" ${selectedPhone === phone ? 'selected' : ''}>${phone}</option>`).join('');
-            phoneSelect.innerHTML = options;
-            
-            // Restore selection if it still exists
-            if (phones.includes(selectedPhone)) {
-                phoneSelect.value = selectedPhone;
-            } else if (phones.length > 0) {
-                // Auto-select first device if none selected
-                selectPhone(phones[0]);
-            } else {
-                selectPhone('');
+            phoneListView.invalidate();
+        }
+        
+        function phoneItems() {
+            return Array.from(phones, ([id, status]) => ({
+                key: id,
+                sig: id === selectedPhone ? status + '*' : status,
+                id: id,
+                status: status
+            }));
+        }
+        
+        function renderDeviceRow(item, el) {
+            if (!el.firstChild) {
+                el.innerHTML = '<div class="device-info"><div class="device-name"></div><div class="device-status"></div></div>';
             }
+            el.className = `device-card ${item.status === 'stale' ? 'stale' : ''} ${item.id === selectedPhone ? 'selected' : ''}`;
+            el.dataset.phone = item.id;
+            const info = el.firstChild;
+            info.firstChild.textContent = item.id;
+            info.lastChild.className = `device-status status-${item.status}`;
+            info.lastChild.textContent = item.status.toUpperCase();
+        }
+        
+        function syncPhoneOptions() {
+            phoneOptionsDirty = false;
+            const phoneSelect = document.getElementById('phoneSelect');
+            for (const [id, option] of phoneOptions) {
+                if (!phones.has(id)) {
+                    option.remove();
+                    phoneOptions.delete(id);
+                }
+            }
+            for (const id of phones.keys()) {
+                if (!phoneOptions.has(id)) {
+                    const option = new Option(id, id);
+                    phoneSelect.appendChild(option);
+                    phoneOptions.set(id, option);
+                }
+            }
+            phoneSelect.value = selectedPhone;
         }
         
         function selectPhone(phoneId) {
@@ -1357,8 +1751,109 @@ HTML_TEMPLATE = """
             updatePhoneDisplay();
         }
         
-        function addToLiveFeed(text) {
+        // Only the rows in view (plus OVERSCAN either side) of a fixed-height
+        // list are in the DOM. Rows are keyed: an element is reused while its
+        // key stays in view and is only rewritten when the item's sig changes.
+        const OVERSCAN = 5;
+        
+        class VirtualList {
+            constructor(container, rowHeight, gap, getItems, renderRow) {
+                this.container = container;
+                this.rowHeight = rowHeight;
+                this.pitch = rowHeight + gap;
+                this.getItems = getItems;
+                this.renderRow = renderRow;
+                this.items = [];
+                this.rows = new Map();
+                this.frame = null;
+                this.stale = true;
+                this.placeholder = container.firstElementChild;
+                this.spacer = document.createElement('div');
+                this.spacer.className = 'virtual-spacer';
+                container.classList.add('virtual-list');
+                container.replaceChildren(this.placeholder, this.spacer);
+                container.addEventListener('scroll', () => this.schedule());
+            }
+            
+            invalidate() {
+                this.stale = true;
+                this.schedule();
+            }
+            
+            schedule() {
+                if (this.frame === null) this.frame = requestAnimationFrame(() => this.render());
+            }
+            
+            render() {
+                this.frame = null;
+                if (this.stale) {
+                    this.items = this.getItems();
+                    this.stale = false;
+                }
+                const count = this.items.length;
+                this.placeholder.style.display = count ? 'none' : '';
+                this.spacer.style.height = `${count * this.pitch}px`;
+                const top = this.container.scrollTop - this.spacer.offsetTop;
+                const first = Math.max(0, Math.floor(top / this.pitch) - OVERSCAN);
+                const last = Math.min(count, Math.ceil((top + this.container.clientHeight) / this.pitch) + OVERSCAN);
+                const shown = new Set();
+                for (let i = first; i < last; i++) {
+                    const item = this.items[i];
+                    let row = this.rows.get(item.key);
+                    if (!row) {
+                        row = {el: document.createElement('div'), sig: undefined, top: -1};
+                        row.el.style.height = `${this.rowHeight}px`;
+                        this.spacer.appendChild(row.el);
+                        this.rows.set(item.key, row);
+                    }
+                    if (row.sig !== item.sig) {
+                        this.renderRow(item, row.el);
+                        row.sig = item.sig;
+                    }
+                    if (row.top !== i) {
+                        row.el.style.top = `${i * this.pitch}px`;
+                        row.top = i;
+                    }
+                    shown.add(item.key);
+                }
+                for (const [key, row] of this.rows) {
+                    if (!shown.has(key)) {
+                        row.el.remove();
+                        this.rows.delete(key);
+                    }
+                }
+            }
+        }
+        
+        // New live feed lines collect in a fragment that is attached, trimmed
+        // to the last LIVE_FEED_LIMIT nodes and scrolled once per frame.
+        const LIVE_FEED_LIMIT = 500;
+        let liveFeedBatch = null;
+        
+        function liveFeedTarget() {
+            if (liveFeedBatch === null) {
+                liveFeedBatch = document.createDocumentFragment();
+                scheduleEventFlush();
+            }
+            return liveFeedBatch;
+        }
+        
+        function flushLiveFeed() {
+            if (liveFeedBatch === null) return;
             const feed = document.getElementById('liveFeed');
+            while (liveFeedBatch.childNodes.length > LIVE_FEED_LIMIT) {
+                liveFeedBatch.removeChild(liveFeedBatch.firstChild);
+            }
+            feed.appendChild(liveFeedBatch);
+            liveFeedBatch = null;
+            while (feed.childNodes.length > LIVE_FEED_LIMIT) {
+                feed.removeChild(feed.firstChild);
+            }
+            feed.scrollTop = feed.scrollHeight;
+        }
+        
+        function addToLiveFeed(text) {
+            const feed = liveFeedTarget();
             const lines = text.split('\\n');
             lines.forEach(line => {
                 if (line.trim()) {
@@ -1367,30 +1862,68 @@ HTML_TEMPLATE = """
                     feed.appendChild(div);
                 }
             });
-            feed.scrollTop = feed.scrollHeight;
         }
         
+        // Streamed output grows one text node per command instead of a
+        // div per line, and stops growing past STREAM_DISPLAY_LIMIT.
+        const STREAM_DISPLAY_LIMIT = 200000;
+        const streamViews = {};
+        
+        function appendStreamChunk(data) {
+            let view = streamViews[data.correlation_id];
+            if (!view) {
+                const pre = document.createElement('pre');
+                pre.className = 'stream-output';
+                const text = document.createTextNode(`> ${data.phone_id}:\\n`);
+                pre.appendChild(text);
+                liveFeedTarget().appendChild(pre);
+                view = streamViews[data.correlation_id] = {text: text, shown: 0};
+            }
+            if (view.shown < STREAM_DISPLAY_LIMIT) {
+                const chunk = data.data.slice(0, STREAM_DISPLAY_LIMIT - view.shown);
+                view.text.appendData(chunk);
+                view.shown += chunk.length;
+                if (view.shown >= STREAM_DISPLAY_LIMIT) {
+                    view.text.appendData('\\n[output truncated in the dashboard]');
+                }
+            }
+            if (data.done) delete streamViews[data.correlation_id];
+        }
+        
+        // The message log keeps the newest MESSAGE_LIMIT messages and shows
+        // them newest first.
+        const MESSAGE_LIMIT = 5000;
+        const messageLog = [];
+        let messageSeq = 0;
+        
         function addMessageToPanel(phoneId, message, timestamp) {
-            const messagesPanel = document.getElementById('messagesPanel');
-            
-            // Remove empty state if it exists
-            if (messagesPanel.querySelector('.empty-state')) {
-                messagesPanel.innerHTML = '';
+            messageLog.push({key: ++messageSeq, sig: 0, phoneId: phoneId, message: message, timestamp: timestamp});
+            messageView.invalidate();
+        }
+        
+        function messageItems() {
+            if (messageLog.length > MESSAGE_LIMIT) {
+                messageLog.splice(0, messageLog.length - MESSAGE_LIMIT);
             }
-            
-            const time = new Date(timestamp).toLocaleTimeString();
-            const messageDiv = document.createElement('div');
-            messageDiv.className = 'message';
-            messageDiv.innerHTML = `
-                <div class="message-time">
-                    <i class="fas fa-mobile-alt"></i>
-                    ${phoneId} • ${time}
-                </div>
-                <div class="message-content">${message}</div>
-            `;
-            messagesPanel.insertBefore(messageDiv, messagesPanel.firstChild);
+            return messageLog.slice().reverse();
         }
         
+        function renderMessageRow(item, el) {
+            el.className = 'message';
+            el.innerHTML = '<div class="message-time"><i class="fas fa-mobile-alt"></i><span></span></div><div class="message-content"></div>';
+            el.firstChild.lastChild.textContent = `${item.phoneId} • ${new Date(item.timestamp).toLocaleTimeString()}`;
+            el.lastChild.textContent = item.message;
+            el.lastChild.title = item.message;
+        }
+        
+        const phoneListView = new VirtualList(document.getElementById('phoneList'), 74, 18, phoneItems, renderDeviceRow);
+        const messageView = new VirtualList(document.getElementById('messagesPanel'), 96, 15, messageItems, renderMessageRow);
+        
+        document.getElementById('phoneList').addEventListener('click', function(event) {
+            const card = event.target.closest('[data-phone]');
+            if (card) selectPhone(card.dataset.phone);
+        });
+        
         function addNumber(num) {
             const display = document.getElementById('phoneNumber');
             display.textContent += num;
@@ -1478,7 +2011,7 @@ ${data.response}
             const display = document.getElementById(`ussdDisplay-${data.session_id}`);
             if (display) {
                 display.textContent = data.response;
-                generateQuickOptions(data.session_id, data.response);
+                generateQuickOptions(data.session_id, data.response, data.menu);
                 
                 if (data.response.includes('Thank you') || data.response.includes('success') || 
                     data.response.includes('Invalid') || data.response.includes('failed')) {
@@ -1517,13 +2050,13 @@ ${data.response}
             }
         }
         
-        function generateQuickOptions(sessionId, response) {
+        function generateQuickOptions(sessionId, response, menu) {
             const optionsContainer = document.getElementById(`ussdOptions-${sessionId}`);
             if (!optionsContainer) return;
             
-            // Extract numbers from response for quick selection
-            const numberMatches = response.match(/\d\./g);
-            if (numberMatches) {
+            // Use the server-parsed menu, falling back to scraping the text
+            const numberMatches = menu ? menu.options.map(option => option.key) : response.match(/\d\./g);
+            if (numberMatches && numberMatches.length) {
                 const options = numberMatches.map(match => match.replace('.', ''));
                 optionsContainer.innerHTML = options.map(opt => `
                     <div class="ussd-option" onclick="document.getElementById('ussdInput-${sessionId}').value='${opt}'; sendUSSDResponse('${sessionId}')">
@@ -1567,7 +2100,9 @@ ${data.response}
                 });
                 
                 const result = await response.json();
-                if (result.status === 'success') {
+                if (response.status === 429) {
+                    showNotification(`Device busy, retry in ${result.retry_after}s`, 'danger');
+                } else if (result.status === 'success') {
                     commandCount++;
                     document.getElementById('totalCommands').textContent = commandCount;
                     showNotification('Command sent successfully!');
@@ -1615,16 +2150,6 @@ ${data.response}
             }
         });
         
-        // Auto-update
-        setInterval(() => {
-            fetch('/api/phones')
-                .then(response => response.json())
-                .then(phoneList => {
-                    phones = phoneList;
-                    updatePhoneDisplay();
-                });
-        }, 2000);
-        
         // Initialize
         updatePhoneDisplay();
     </script>
@@ -1632,193 +2157,919 @@ ${data.response}
 </html>
 """
 
+class CachedPage:
+    """A page rendered once at startup and served as pre-encoded bytes."""
+
+    def __init__(self, html, mimetype='text/html', cache_control='no-cache'):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.body = html.encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.variants = {'identity': self.body, 'gzip': gzip.compress(self.body, compresslevel=9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body, quality=11)
+
+    def _pick_encoding(self):
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self):
+        if self.etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            encoding = self._pick_encoding()
+            response = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+control_panel_page = CachedPage(app.jinja_env.from_string(HTML_TEMPLATE).render())
+
 @app.route('/')
 def control_panel():
-    return render_template_string(HTML_TEMPLATE)
+    return control_panel_page.response()
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/phones')
 def get_phones():
-    with phone_lock:
-        return jsonify(list(connected_phones.keys()))
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify(connected_phones.keys())
+    return jsonify(connected_phones.deltas_since(since))
+
+@app.route('/api/phones/<phone_id>/messages')
+def get_phone_messages(phone_id):
+    """Page back through a phone's messages, newest first.
+
+    Pass the returned ``next_before`` as ``before`` to get the next page;
+    ``type`` filters by message type.
+    """
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', 50, type=int)
+    message_type = request.args.get('type')
+    if limit < 1:
+        return jsonify({'status': 'error', 'error': 'limit must be positive'}), 400
+    limit = min(limit, 500)
+    if history_store:
+        messages = history_store.page(phone_id, before, limit, message_type)
+    else:
+        records = [r for r in phone_messages.get(phone_id)
+                   if (before is None or r.id < before) and (not message_type or r.type == message_type)]
+        messages = [r.to_dict() for r in reversed(records[-limit:])]
+    return jsonify({
+        'phone_id': phone_id,
+        'messages': messages,
+        'next_before': messages[-1]['id'] if len(messages) == limit else None
+    })
+
+def send_to_device(phone_id, payload, sid=None):
+    """Emit a ``command`` to a phone in the encoding it negotiated."""
+    phone = connected_phones.get(phone_id)
+    if sid is None:
+        if not phone:
+            return
+        sid = phone['sid']
+    if phone and phone['encoding'] == 'msgpack':
+        payload = wire.encode(payload)
+    socketio.emit('command', payload, room=sid)
+
+def emit_ready(ready):
+    for phone_id, payload in ready:
+        send_to_device(phone_id, payload)
+
+def dispatch_command(phone_id, command, stream=False, keep_output=False):
+    """Queue a shell command for a phone and emit whatever can go out now.
+
+    With ``stream`` the device is asked to send its output as
+    ``command_output`` chunks; ``keep_output`` also stores the joined output
+    (up to ``STREAM_KEEP_MAX_BYTES``) when the stream ends.
+
+    Returns ``(delivery, correlation_id)`` where delivery is ``'sent'``,
+    ``'queued'``, ``'forwarded'`` (to the worker that owns the phone, which
+    queues it there), or ``None`` if the phone is unknown. Raises
+    ``QueueFull``.
+    """
+    correlation_id = uuid.uuid4().hex
+    payload = {'action': 'shell', 'command': command, 'correlation_id': correlation_id}
+    if stream:
+        payload['stream'] = True
+    phone = connected_phones.get(phone_id)
+    owner = phone['worker'] if phone and phone['worker'] != WORKER_ID else None
+    if owner:
+        # The owning worker sees this phone's responses, so it queues,
+        # tracks and delivers the command.
+        delivery, ready = 'forwarded', []
+    else:
+        delivery, ready = outbound_queues.submit(phone_id, correlation_id, payload, phone is not None)
+        if delivery is None:
+            return None, None
+    record = phone_messages.append(phone_id, 'command', command, 'outgoing')
+    payload['message_id'] = record.id
+    command_tracker.dispatch(phone_id, command, record.id, correlation_id)
+    log.debug('command_dispatched', phone_id=phone_id, correlation_id=correlation_id, delivery=delivery)
+    if owner:
+        # The output chunks arrive at the owner too, so it opens the stream.
+        cluster.forward_command(owner, phone_id, command, payload, keep_output)
+    elif stream:
+        output_streams.open(correlation_id, phone_id, keep_output)
+    emit_ready(ready)
+    return delivery, correlation_id
+
+def handle_forwarded_command(message):
+    """Queue a command another worker dispatched to a phone this one owns.
+
+    A command the queue refuses is reported back to its origin.
+    """
+    phone_id = message['phone_id']
+    payload = message['payload']
+    correlation_id = payload['correlation_id']
+    phone = connected_phones.get(phone_id)
+    try:
+        delivery, ready = outbound_queues.submit(phone_id, correlation_id, payload,
+                                                 phone is not None and phone['worker'] == WORKER_ID)
+    except QueueFull as e:
+        commands_rejected.inc()
+        cluster.announce_command_rejected(message['worker'], phone_id, correlation_id, 'queue full',
+                                          e.retry_after)
+        return
+    if delivery is None:
+        cluster.announce_command_rejected(message['worker'], phone_id, correlation_id, 'phone not found')
+        return
+    command_tracker.dispatch(phone_id, message['command'], payload.get('message_id'), correlation_id,
+                             origin=message['worker'])
+    if payload.get('stream'):
+        output_streams.open(correlation_id, phone_id, bool(message.get('keep_output')))
+    emit_ready(ready)
+
+def handle_rejected_command(message):
+    """The owning worker refused a command this one forwarded."""
+    command_tracker.cancel(message['correlation_id'])
+    log.warning('command_rejected', phone_id=message['phone_id'], correlation_id=message['correlation_id'],
+                status=message['status'], retry_after=message.get('retry_after'))
+    socketio.emit('new_message', {
+        'phone_id': message['phone_id'],
+        'message': f"Command rejected: {message['status']}",
+        'timestamp': datetime.now().isoformat()
+    }, to=phone_audience(message['phone_id']))
+
+def complete_command(phone_id, correlation_id=None):
+    """``command_tracker.complete``, passing forwarded commands' completion back to their origin."""
+    tracked = command_tracker.complete(phone_id, correlation_id)
+    if tracked is not None and tracked.origin and cluster:
+        cluster.announce_command_done(tracked.origin, tracked.phone_id, tracked.correlation_id)
+    return tracked
+
+if cluster:
+    cluster.on_command = handle_forwarded_command
+    cluster.on_command_done = lambda message: command_tracker.complete(message['phone_id'],
+                                                                       message['correlation_id'])
+    cluster.on_command_rejected = handle_rejected_command
 
 @app.route('/api/command', methods=['POST'])
+@timed('api_command')
 def send_command():
     data = request.json
     phone_id = data.get('phone')
     command = data.get('command')
     
-    with phone_lock:
-        if phone_id in connected_phones:
-            if phone_id not in phone_messages:
-                phone_messages[phone_id] = []
-            
-            message_data = {
-                'type': 'command',
-                'content': command,
-                'timestamp': datetime.now().isoformat(),
-                'direction': 'outgoing'
-            }
-            phone_messages[phone_id].append(message_data)
-            
-            socketio.emit('command', {
-                'action': 'shell', 
-                'command': command,
-                'message_id': len(phone_messages[phone_id])
-            }, room=connected_phones[phone_id]['sid'])
-            
-            socketio.emit('new_message', {
-                'phone_id': phone_id,
-                'message': f"Command: {command}",
-                'timestamp': datetime.now().isoformat()
-            })
-            
-            return jsonify({'status': 'success'})
+    try:
+        delivery, correlation_id = dispatch_command(phone_id, command, bool(data.get('stream')),
+                                                    bool(data.get('keep_output')))
+    except QueueFull as e:
+        commands_rejected.inc()
+        log.warning('command_rejected', phone_id=phone_id, retry_after=e.retry_after)
+        response = jsonify({'status': 'queue full', 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    if delivery is None:
+        return jsonify({'status': 'phone not found'})
+    
+    socketio.emit('new_message', {
+        'phone_id': phone_id,
+        'message': f"Command: {command}",
+        'timestamp': datetime.now().isoformat()
+    }, to=phone_audience(phone_id))
     
-    return jsonify({'status': 'phone not found'})
+    return jsonify({'status': 'success', 'delivery': delivery, 'correlation_id': correlation_id})
+
+def transfer_limited(e):
+    response = jsonify({'status': 'too many transfers', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.route('/api/phones/<phone_id>/files', methods=['POST'])
+@timed('api_send_file')
+def send_file_to_phone(phone_id):
+    """Send the request body to a phone as file ``name``, saved at ``path`` on the device.
+
+    The body is spooled to disk and the device pulls it in chunks; watch
+    ``/api/transfers/<transfer_id>`` or the ``transfer_progress`` event.
+    """
+    name = request.args.get('name')
+    if not name:
+        return jsonify({'status': 'error', 'error': 'name is required'}), 400
+    if phone_id not in connected_phones:
+        return jsonify({'status': 'phone not found'})
+    try:
+        transfer = transfers.create_download(phone_id, name, request.stream)
+    except TransferLimit as e:
+        return transfer_limited(e)
+    send_to_device(phone_id, {
+        'action': 'download_file',
+        'transfer_id': transfer.transfer_id,
+        'name': transfer.name,
+        'path': request.args.get('path'),
+        'size': transfer.size,
+        'sha256': transfer.sha256,
+        'chunk_size': transfer.chunk_size
+    })
+    return jsonify(transfer.to_dict()), 202
+
+@app.route('/api/phones/<phone_id>/files/pull', methods=['POST'])
+@timed('api_pull_file')
+def pull_file_from_phone(phone_id):
+    """Ask a phone to upload the file at ``path``; fetch it from ``/api/transfers/<id>/file``."""
+    path = (request.json or {}).get('path')
+    if not path:
+        return jsonify({'status': 'error', 'error': 'path is required'}), 400
+    if phone_id not in connected_phones:
+        return jsonify({'status': 'phone not found'})
+    try:
+        transfer = transfers.create_upload(phone_id, path.rsplit('/', 1)[-1])
+    except TransferLimit as e:
+        return transfer_limited(e)
+    send_to_device(phone_id, {
+        'action': 'upload_file',
+        'transfer_id': transfer.transfer_id,
+        'path': path,
+        'chunk_size': transfer.chunk_size
+    })
+    return jsonify(transfer.to_dict()), 202
+
+@app.route('/api/transfers')
+def list_transfers():
+    return jsonify([t.to_dict() for t in transfers.active()])
+
+@app.route('/api/transfers/<transfer_id>', methods=['GET', 'DELETE'])
+def get_transfer(transfer_id):
+    if request.method == 'DELETE':
+        return jsonify({'deleted': transfers.delete(transfer_id)})
+    transfer = transfers.get(transfer_id)
+    if transfer is None:
+        return jsonify({'status': 'unknown transfer'}), 404
+    return jsonify(transfer.to_dict())
+
+@app.route('/api/transfers/<transfer_id>/file')
+def get_transfer_file(transfer_id):
+    transfer = transfers.get(transfer_id)
+    if transfer is None or transfer.status != 'complete':
+        return jsonify({'status': 'file not available'}), 404
+    return send_file(transfers.path(transfer_id), as_attachment=True, download_name=transfer.name,
+                     mimetype='application/octet-stream')
+
+def select_phones(data):
+    """Resolve a ``phones`` / ``tag`` / ``all`` target from a request body."""
+    if data.get('phones') is not None:
+        return connected_phones.select(phone_ids=data['phones'])
+    if data.get('tag'):
+        return connected_phones.select(tag=data['tag'])
+    if data.get('all'):
+        return connected_phones.select()
+    return None
+
+@app.route('/api/commands/bulk', methods=['POST'])
+def send_bulk_command():
+    """Dispatch one command to many phones, streaming per-phone results as NDJSON.
+
+    The body names the targets with exactly one of ``phones`` (a list of
+    ids), ``tag`` or ``all: true``. Commands go through each phone's
+    outbound queue in batches of ``BULK_BATCH_SIZE`` without holding any
+    registry lock; the last line is a summary with the dispatch rate. The
+    fan-out finishes even if the client disconnects mid-stream.
+    """
+    data = request.json or {}
+    command = data.get('command')
+    if not command:
+        return jsonify({'status': 'error', 'error': 'command is required'}), 400
+    selection = select_phones(data)
+    if selection is None:
+        return jsonify({'status': 'error', 'error': 'one of phones, tag or all is required'}), 400
+    targets, missing = selection
+
+    results = queue.Queue()
+
+    def dispatch():
+        # Runs as a background task so a client that stops reading can't
+        # stop the fan-out halfway; the response only drains ``results``.
+        start = time.perf_counter()
+        counts = {'accepted': 0, 'queue full': 0, 'phone not found': len(missing)}
+        for phone_id in missing:
+            results.put(json.dumps({'phone': phone_id, 'status': 'phone not found'}) + '\n')
+        for offset in range(0, len(targets), BULK_BATCH_SIZE):
+            batch = targets[offset:offset + BULK_BATCH_SIZE]
+            lines = []
+            accepted = []
+            for phone_id, _ in batch:
+                try:
+                    delivery, correlation_id = dispatch_command(phone_id, command)
+                except QueueFull as e:
+                    line = {'phone': phone_id, 'status': 'queue full', 'retry_after': e.retry_after}
+                else:
+                    if delivery is None:
+                        line = {'phone': phone_id, 'status': 'phone not found'}
+                    else:
+                        line = {'phone': phone_id, 'status': 'accepted', 'delivery': delivery,
+                                'correlation_id': correlation_id}
+                        accepted.append(phone_id)
+                counts[line['status']] += 1
+                lines.append(json.dumps(line))
+            if accepted:
+                # One event for the firehose; dashboards watching single
+                # phones get a message for each of theirs.
+                timestamp = datetime.now().isoformat()
+                socketio.emit('bulk_dispatch', {
+                    'phone_ids': accepted,
+                    'command': command,
+                    'timestamp': timestamp
+                }, to=FIREHOSE_ROOM)
+                for phone_id in accepted:
+                    socketio.emit('new_message', {
+                        'phone_id': phone_id,
+                        'message': f"Bulk command: {command}",
+                        'timestamp': timestamp
+                    }, to=phone_room(phone_id))
+            results.put('\n'.join(lines) + '\n')
+            socketio.sleep(0)
+        elapsed = time.perf_counter() - start
+        results.put(json.dumps({'summary': {
+            'accepted': counts['accepted'],
+            'queue_full': counts['queue full'],
+            'not_found': counts['phone not found'],
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'dispatch_rate': round(counts['accepted'] / elapsed, 1) if elapsed else None
+        }}) + '\n')
+        results.put(None)
+
+    def stream():
+        while True:
+            lines = results.get()
+            if lines is None:
+                return
+            yield lines
+
+    socketio.start_background_task(dispatch)
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/api/commands/latency')
+def get_command_latency():
+    return jsonify(command_tracker.latency(request.args.get('phone')))
+
+@app.route('/api/commands/<correlation_id>')
+def get_command_status(correlation_id):
+    record = command_tracker.get(correlation_id)
+    if record is None:
+        return jsonify({'status': 'unknown command'}), 404
+    return jsonify(record.to_dict())
 
 # USSD Session Management
-@socketio.on('start_ussd')
-def handle_start_ussd(data):
-    phone_id = data.get('phone_id')
+def create_ussd_session(phone_id, ussd_code):
+    global ussd_reaper_started
+    phone = connected_phones.get(phone_id)
+    if not phone or phone['worker'] != WORKER_ID:
+        # ussd_update only reaches the worker that owns the phone's socket.
+        return None
+    if not ussd_reaper_started:
+        ussd_reaper_started = True
+        socketio.start_background_task(reap_ussd_sessions)
+    return ussd_sessions.start(phone_id, ussd_code, phone['sid'])
+
+def send_ussd_start(session, announce=True):
+    phone_messages.append(session.phone_id, 'ussd', f'start_ussd:{session.ussd_code}', 'outgoing')
+    send_to_device(session.phone_id, {
+        'action': 'ussd',
+        'command': f'start_ussd:{session.ussd_code}',
+        'session_id': session.session_id
+    }, session.sid)
+    
+    if announce:
+        socketio.emit('ussd_session_start', {
+            'session_id': session.session_id,
+            'phone_id': session.phone_id,
+            'ussd_code': session.ussd_code,
+            'response': 'Connecting to mobile network...',
+            'timestamp': datetime.now().isoformat()
+        }, to=phone_audience(session.phone_id))
+
+def send_ussd_input(session, response):
+    session.path.append(response)
+    phone_messages.append(session.phone_id, 'ussd', response, 'outgoing')
+    send_to_device(session.phone_id, {
+        'action': 'ussd',
+        'command': f'ussd_response:{response}',
+        'session_id': session.session_id
+    }, session.sid)
+
+def end_ussd_session(session, reason, status='ended', notify_device=True):
+    """Tell the device and dashboards a session is over (it is already removed)."""
+    phone_messages.append(session.phone_id, 'ussd', f'end_ussd: {reason}', 'info')
+    if notify_device:
+        send_to_device(session.phone_id, {
+            'action': 'ussd',
+            'command': 'end_ussd',
+            'session_id': session.session_id
+        }, session.sid)
+    
+    campaign = ussd_campaigns.on_end(session.session_id, status)
+    if campaign:
+        socketio.emit('ussd_campaign_update', campaign.to_dict(include_results=False), to=FIREHOSE_ROOM)
+        run_ussd_campaign(campaign)
+        return
+    
+    socketio.emit('ussd_session_end', {
+        'session_id': session.session_id,
+        'phone_id': session.phone_id,
+        'response': reason,
+        'timestamp': datetime.now().isoformat()
+    }, to=phone_audience(session.phone_id))
+
+def reap_ussd_sessions():
+    while True:
+        socketio.sleep(REAP_INTERVAL)
+        for session in ussd_sessions.reap():
+            end_ussd_session(session, 'Session timed out', 'timeout')
+
+def run_ussd_campaign(campaign):
+    for session in ussd_campaigns.start_next(campaign, create_ussd_session):
+        send_ussd_start(session, announce=False)
+
+@app.route('/api/ussd/campaigns', methods=['POST'])
+def start_ussd_campaign():
+    """Run one USSD code and menu path on many phones at once.
+
+    Body: ``ussd_code``, optional ``menu_path`` (inputs sent to successive
+    menus), ``concurrency``, and a ``phones`` / ``tag`` / ``all`` target.
+    Poll ``/api/ussd/campaigns/<id>`` for the results. In cluster mode only
+    phones connected to this worker take part; the others are reported as
+    ``unsupported``.
+    """
+    data = request.json or {}
     ussd_code = data.get('ussd_code')
+    if not ussd_code:
+        return jsonify({'status': 'error', 'error': 'ussd_code is required'}), 400
+    selection = select_phones(data)
+    if selection is None:
+        return jsonify({'status': 'error', 'error': 'one of phones, tag or all is required'}), 400
+    targets, missing = selection
+    local, remote = [], []
+    for phone_id, _ in targets:
+        phone = connected_phones.get(phone_id)
+        (remote if phone and phone['worker'] != WORKER_ID else local).append(phone_id)
     
-    with phone_lock:
-        if phone_id in connected_phones:
-            session_id = f"ussd_{phone_id}_{int(time.time())}"
-            ussd_sessions[session_id] = {
-                'phone_id': phone_id,
-                'ussd_code': ussd_code,
-                'started_at': datetime.now(),
-                'sid': connected_phones[phone_id]['sid'],
-                'active': True
-            }
-            
-            socketio.emit('command', {
-                'action': 'ussd',
-                'command': f'start_ussd:{ussd_code}',
-                'session_id': session_id
-            }, room=connected_phones[phone_id]['sid'])
-            
-            socketio.emit('ussd_session_start', {
-                'session_id': session_id,
-                'phone_id': phone_id,
-                'ussd_code': ussd_code,
-                'response': 'Connecting to mobile network...',
-                'timestamp': datetime.now().isoformat()
-            })
+    campaign = ussd_campaigns.create(ussd_code, data.get('menu_path') or [], local + missing,
+                                     int(data.get('concurrency') or USSD_CAMPAIGN_CONCURRENCY),
+                                     unsupported=remote)
+    run_ussd_campaign(campaign)
+    return jsonify(campaign.to_dict(include_results=False)), 202
+
+@app.route('/api/ussd/campaigns')
+def list_ussd_campaigns():
+    return jsonify([c.to_dict(include_results=False) for c in ussd_campaigns.list()])
+
+@app.route('/api/ussd/campaigns/<campaign_id>')
+def get_ussd_campaign(campaign_id):
+    campaign = ussd_campaigns.get(campaign_id)
+    if campaign is None:
+        return jsonify({'status': 'unknown campaign'}), 404
+    return jsonify(campaign.to_dict())
+
+@app.route('/api/ussd/menus')
+def get_ussd_menus():
+    """Cached menu tree for ``ussd_code``, or one menu with ``path=1,2``."""
+    ussd_code = request.args.get('ussd_code')
+    if not ussd_code:
+        return jsonify({'status': 'error', 'error': 'ussd_code is required'}), 400
+    path = request.args.get('path')
+    if path is None:
+        return jsonify(ussd_menus.tree(ussd_code))
+    node = ussd_menus.get(ussd_code, [step for step in path.split(',') if step])
+    if node is None:
+        return jsonify({'status': 'menu not cached'}), 404
+    return jsonify(node.to_dict())
+
+@app.route('/api/ussd/menus/ref/<ref>')
+def get_ussd_menu_ref(ref):
+    node = ussd_menus.get_ref(ref)
+    if node is None:
+        return jsonify({'status': 'menu not cached'}), 404
+    return jsonify(node.to_dict())
+
+# Dashboard USSD actions. A session lives on the worker that owns the
+# phone's socket, since that is where ussd_update arrives; in cluster mode
+# actions for sessions elsewhere are forwarded there.
+def start_ussd(data):
+    session = create_ussd_session(data.get('phone_id'), data.get('ussd_code'))
+    if session:
+        send_ussd_start(session)
+    return session is not None
+
+def answer_ussd(data):
+    session = ussd_sessions.touch(data.get('session_id'))
+    if session:
+        send_ussd_input(session, data.get('response'))
+    return session is not None
+
+def stop_ussd(data):
+    session = ussd_sessions.end(data.get('session_id'))
+    if session:
+        end_ussd_session(session, 'Session ended by user')
+    return session is not None
+
+USSD_ACTIONS = {'start_ussd': start_ussd, 'ussd_response': answer_ussd, 'end_ussd': stop_ussd}
+
+def handle_forwarded_ussd(message):
+    USSD_ACTIONS[message['event']](message['data'])
+
+if cluster:
+    cluster.on_ussd = handle_forwarded_ussd
+
+@socketio.on('start_ussd')
+@timed('start_ussd')
+def handle_start_ussd(data):
+    phone = connected_phones.get(data.get('phone_id'))
+    if phone and phone['worker'] != WORKER_ID:
+        cluster.forward_ussd('start_ussd', data, owner=phone['worker'])
+    elif not start_ussd(data):
+        socketio.emit('ussd_error', {'phone_id': data.get('phone_id'), 'error': 'Phone not found'},
+                      to=request.sid)
 
 @socketio.on('ussd_response')
+@timed('ussd_response')
 def handle_ussd_response(data):
-    session_id = data.get('session_id')
-    response = data.get('response')
-    
-    if session_id in ussd_sessions:
-        session = ussd_sessions[session_id]
-        socketio.emit('command', {
-            'action': 'ussd',
-            'command': f'ussd_response:{response}',
-            'session_id': session_id
-        }, room=session['sid'])
+    if not answer_ussd(data) and cluster:
+        cluster.forward_ussd('ussd_response', data)
 
 @socketio.on('end_ussd')
+@timed('end_ussd')
 def handle_end_ussd(data):
-    session_id = data.get('session_id')
-    if session_id in ussd_sessions:
-        session = ussd_sessions[session_id]
-        socketio.emit('command', {
-            'action': 'ussd',
-            'command': 'end_ussd',
-            'session_id': session_id
-        }, room=session['sid'])
-        
-        del ussd_sessions[session_id]
-        socketio.emit('ussd_session_end', {
-            'session_id': session_id,
-            'phone_id': session['phone_id'],
-            'response': 'Session ended by user',
-            'timestamp': datetime.now().isoformat()
-        })
+    if not stop_ussd(data) and cluster:
+        cluster.forward_ussd('end_ussd', data)
 
 @socketio.on('ussd_update')
+@timed('ussd_update')
+@device_event
 def handle_ussd_update(data):
     session_id = data.get('session_id')
     response = data.get('response')
     
-    if session_id in ussd_sessions:
-        socketio.emit('ussd_update', {
-            'session_id': session_id,
-            'response': response,
-            'timestamp': datetime.now().isoformat()
-        })
+    session = ussd_sessions.touch(session_id)
+    if not session:
+        return
+    
+    phone_messages.append(session.phone_id, 'ussd', response, 'incoming')
+    mark_alive(session.phone_id)
+    menu, unchanged = ussd_menus.observe(session.ussd_code, session.path, response)
+    is_campaign, next_input = ussd_campaigns.on_update(session_id, response)
+    if is_campaign:
+        if next_input is not None:
+            send_ussd_input(session, next_input)
+        elif ussd_sessions.end(session_id):
+            end_ussd_session(session, response, 'completed')
+        return
+    
+    update = {
+        'session_id': session_id,
+        'response': response,
+        'menu_ref': menu.ref,
+        'timestamp': datetime.now().isoformat()
+    }
+    if not unchanged:
+        # Dashboards keep parsed menus by ref, so a repeat screen comes
+        # without one; /api/ussd/menus/ref/<ref> serves ones they missed.
+        update['menu'] = {'prompt': menu.prompt, 'options': menu.options}
+    socketio.emit('ussd_update', update, to=phone_audience(session.phone_id))
+
+def mark_alive(phone_id):
+    """Any device traffic refreshes ``last_seen`` and clears a stale mark."""
+    connected_phones.touch(phone_id)
+    if liveness.beat(phone_id):
+        delta = connected_phones.set_status(phone_id, 'online')
+        if delta:
+            emit_phone_delta(delta)
+
+def sweep_outbound_queues():
+    # Releases commands stuck behind ones the phone never answered.
+    while True:
+        socketio.sleep(OUTBOUND_SWEEP_INTERVAL)
+        emit_ready(outbound_queues.sweep())
+
+def sweep_liveness():
+    while True:
+        socketio.sleep(BUCKET_SECONDS)
+        stale, offline = liveness.sweep()
+        for phone_id in stale:
+            delta = connected_phones.set_status(phone_id, 'stale')
+            if delta:
+                log.info('phone_stale', phone_id=phone_id)
+                emit_phone_delta(delta)
+        for phone_id in offline:
+            phone = connected_phones.get(phone_id)
+            if phone and phone['worker'] == WORKER_ID:
+                log.info('phone_offline', phone_id=phone_id)
+                # Closing the socket runs handle_disconnect, which cleans up.
+                socketio.server.disconnect(phone['sid'])
+
+@socketio.on('heartbeat')
+@timed('heartbeat')
+@device_event
+def handle_heartbeat(data=None):
+    phone_id = (data or {}).get('phone_id')
+    for phone_id in [phone_id] if phone_id else connected_phones.phones_for_sid(request.sid):
+        mark_alive(phone_id)
+    return {'heartbeat_interval': HEARTBEAT_INTERVAL}
 
 @socketio.on('connect')
 def handle_connect():
-    print(f"🔗 New connection: {request.sid}")
+    log.debug('socket_connected', sid=request.sid)
+
+def send_dashboard_batches():
+    for sid, events in dashboard_outbox.drain():
+        socketio.emit('event_batch', events, to=sid, ignore_queue=True)
+
+def flush_dashboard_outbox():
+    while True:
+        socketio.sleep(dashboard_outbox.interval)
+        send_dashboard_batches()
+
+@socketio.on('join_dashboard')
+def handle_join_dashboard(data=None):
+    global dashboard_outbox_flusher_started
+    join_room(DASHBOARD_ROOM)
+    if client_manager.outbox is not None and not dashboard_outbox_flusher_started:
+        dashboard_outbox_flusher_started = True
+        socketio.start_background_task(flush_dashboard_outbox)
+    handle_subscribe_phones(data or {})
+
+@socketio.on('subscribe_phones')
+def handle_subscribe_phones(data=None):
+    """Limit a dashboard to events for ``phone_ids``; omit it to get every phone."""
+    data = data or {}
+    phone_ids = data.get('phone_ids')
+    if phone_ids is None:
+        join_room(FIREHOSE_ROOM)
+    else:
+        leave_room(FIREHOSE_ROOM)
+        for phone_id in phone_ids:
+            join_room(phone_room(phone_id))
+    for phone_id in data.get('unsubscribe', []):
+        leave_room(phone_room(phone_id))
 
 @socketio.on('disconnect')
+@timed('disconnect')
 def handle_disconnect():
-    with phone_lock:
-        phones_to_remove = []
-        for phone_id, phone_data in connected_phones.items():
-            if phone_data['sid'] == request.sid:
-                phones_to_remove.append(phone_id)
-        
-        for phone_id in phones_to_remove:
-            del connected_phones[phone_id]
-            print(f"❌ {phone_id} - DISCONNECTED (Total: {len(connected_phones)})")
+    dashboard_outbox.forget(request.sid)
+    deltas = connected_phones.remove_sid(request.sid)
+    for delta in deltas:
+        log.info('phone_disconnected', phone_id=delta['phone_id'], total=len(connected_phones))
+        liveness.forget(delta['phone_id'])
+        outbound_queues.disconnected(delta['phone_id'])
+        for session in ussd_sessions.end_phone(delta['phone_id']):
+            end_ussd_session(session, 'Device disconnected', 'disconnected', notify_device=False)
+        if cluster:
+            cluster.announce_remove(delta['phone_id'], request.sid)
     
-    socketio.emit('phone_list_update', list(connected_phones.keys()))
+    for delta in deltas:
+        emit_phone_delta(delta)
 
 @socketio.on('register')
+@timed('register')
+@device_event
 def handle_register(data):
+    global liveness_sweeper_started, outbound_sweeper_started
     phone_id = data.get('device_id')
-    with phone_lock:
-        connected_phones[phone_id] = {
-            'sid': request.sid,
-            'connected_at': datetime.now(),
-            'last_seen': datetime.now()
-        }
-        print(f"✅ {phone_id} - CONNECTED (Total: {len(connected_phones)})")
+    tags = data.get('tags') or ()
+    encoding = wire.negotiate(data.get('encodings'))
+    delta = connected_phones.register(phone_id, request.sid, WORKER_ID, tags, encoding)
+    log.info('phone_connected', phone_id=phone_id, total=len(connected_phones), tags=list(tags))
+    
+    if data.get('heartbeat'):
+        liveness.watch(phone_id)
+        if not liveness_sweeper_started:
+            liveness_sweeper_started = True
+            socketio.start_background_task(sweep_liveness)
+    else:
+        # Clients that never send heartbeats are left to Engine.IO's ping
+        # timeout; the sweeper would drop them and they don't reconnect.
+        liveness.forget(phone_id)
     
-    socketio.emit('phone_list_update', list(connected_phones.keys()))
+    if cluster:
+        cluster.announce_register(phone_id, request.sid, tags, encoding)
+    join_room(DEVICE_ROOM)
+    emit_phone_delta(delta)
+    emit_ready(outbound_queues.connected(phone_id))
+    if not outbound_sweeper_started:
+        outbound_sweeper_started = True
+        socketio.start_background_task(sweep_outbound_queues)
     socketio.emit('new_message', {
         'phone_id': phone_id,
         'message': "Device connected successfully",
         'timestamp': datetime.now().isoformat()
-    })
+    }, to=phone_audience(phone_id))
+    return {'heartbeat_interval': HEARTBEAT_INTERVAL, 'encoding': encoding}
+
+@socketio.on('command_ack')
+@timed('command_ack')
+@device_event
+def handle_command_ack(data):
+    command_tracker.ack(data.get('correlation_id'))
 
 @socketio.on('message_response')
+@timed('message_response')
+@device_event
 def handle_message_response(data):
     phone_id = data.get('phone_id')
     message = data.get('message')
     message_type = data.get('type', 'info')
     
-    if phone_id not in phone_messages:
-        phone_messages[phone_id] = []
-    
-    phone_messages[phone_id].append({
-        'type': message_type,
-        'content': message,
-        'timestamp': datetime.now().isoformat(),
-        'direction': 'incoming'
-    })
+    phone_messages.append(phone_id, message_type, message, 'incoming')
+    mark_alive(phone_id)
+    if data.get('correlation_id'):
+        # A device that can't stream answers a streamed command in one go.
+        output_streams.close(data['correlation_id'])
+    tracked = complete_command(phone_id, data.get('correlation_id'))
+    log.debug('command_response', phone_id=phone_id, type=message_type,
+              correlation_id=tracked.correlation_id if tracked else None)
+    emit_ready(outbound_queues.complete(phone_id, tracked.correlation_id if tracked else None))
     
     socketio.emit('new_message', {
         'phone_id': phone_id,
         'message': f"{message_type.upper()}: {message}",
+        'type': message_type,
+        'correlation_id': tracked.correlation_id if tracked else None,
         'timestamp': datetime.now().isoformat()
-    })
+    }, to=phone_audience(phone_id))
     
     socketio.emit('command_response', {
         'phone_id': phone_id,
-        'response': message
-    })
+        'response': message,
+        'correlation_id': tracked.correlation_id if tracked else None
+    }, to=phone_audience(phone_id))
+
+@socketio.on('command_output')
+@timed('command_output')
+@device_event
+def handle_command_output(data):
+    """Relay one chunk of streamed output; it is only joined if it is being kept."""
+    correlation_id = data.get('correlation_id')
+    stream, ready = output_streams.chunk(correlation_id, data.get('seq', 0), data.get('data') or '',
+                                         bool(data.get('done')))
+    if stream is None:
+        return
+    mark_alive(stream.phone_id)
+    audience = phone_audience(stream.phone_id)
+    for seq, chunk, done in ready:
+        socketio.emit('command_output', {
+            'phone_id': stream.phone_id,
+            'correlation_id': correlation_id,
+            'seq': seq,
+            'data': chunk,
+            'done': done
+        }, to=audience)
+    if stream.done:
+        finish_output_stream(stream)
+
+def finish_output_stream(stream):
+    summary = stream.summary()
+    output = stream.output()
+    if output is None:
+        output = f"[streamed {summary['bytes']} chars in {summary['chunks']} chunks]"
+    phone_messages.append(stream.phone_id, 'shell', output, 'incoming')
+    complete_command(stream.phone_id, stream.correlation_id)
+    emit_ready(outbound_queues.complete(stream.phone_id, stream.correlation_id))
+    socketio.emit('command_response', {
+        'phone_id': stream.phone_id,
+        'response': None,
+        'correlation_id': stream.correlation_id,
+        'streamed': True,
+        **summary
+    }, to=phone_audience(stream.phone_id))
+
+def report_transfer(transfer):
+    """Emit ``transfer_progress`` at most every ``TRANSFER_PROGRESS_INTERVAL`` and when it ends."""
+    now = time.monotonic()
+    if not transfer.finished and now - transfer.reported_at < TRANSFER_PROGRESS_INTERVAL:
+        return
+    transfer.reported_at = now
+    socketio.emit('transfer_progress', transfer.to_dict(), to=phone_audience(transfer.phone_id))
+
+def finish_transfer(transfer):
+    """Add a finished transfer to the phone's history, once even if its last chunk is re-read."""
+    if not transfers.announce(transfer):
+        return
+    verb = 'received' if transfer.direction == 'upload' else 'sent'
+    phone_messages.append(transfer.phone_id, 'file', f"{verb} {transfer.name} ({transfer.size} bytes): "
+                          f"{transfer.status}", 'incoming')
+    log.info('transfer_finished', phone_id=transfer.phone_id, transfer_id=transfer.transfer_id,
+             direction=transfer.direction, size=transfer.size, status=transfer.status)
+
+def transfer_error(e):
+    if isinstance(e, TransferLimit):
+        return {'error': str(e), 'retry_after': e.retry_after}
+    return {'error': str(e)}
+
+@socketio.on('transfer_start')
+@timed('transfer_start')
+@device_event
+def handle_transfer_start(data):
+    """Open or resume a transfer; the reply's ``offset`` is where the device carries on.
+
+    Without ``transfer_id`` the device starts an upload of its own
+    (``phone_id``, ``name``, ``size`` and optionally ``sha256``).
+    """
+    try:
+        if data.get('transfer_id'):
+            transfer = transfers.start(data['transfer_id'], data.get('size'), data.get('sha256'))
+        else:
+            transfer = transfers.create_upload(data.get('phone_id'), data.get('name'), data.get('size'),
+                                               data.get('sha256'))
+    except TransferError as e:
+        return transfer_error(e)
+    mark_alive(transfer.phone_id)
+    report_transfer(transfer)
+    return {
+        'transfer_id': transfer.transfer_id,
+        'offset': transfer.received,
+        'chunk_size': transfer.chunk_size,
+        'status': transfer.status
+    }
+
+@socketio.on('transfer_chunk')
+@timed('transfer_chunk')
+@device_event
+def handle_transfer_chunk(data):
+    """Store one upload chunk; the reply's ``offset`` is the next one the server expects."""
+    chunk = data.get('data') or b''
+    try:
+        transfer, written, wait = transfers.write(data.get('transfer_id'), data.get('offset', 0), chunk,
+                                                  data.get('crc32'))
+    except TransferError as e:
+        return transfer_error(e)
+    mark_alive(transfer.phone_id)
+    if written:
+        transfer_bytes.labels('upload').inc(written)
+        report_transfer(transfer)
+        if transfer.finished:
+            finish_transfer(transfer)
+    return {'offset': transfer.received, 'status': transfer.status, 'wait': wait}
+
+@socketio.on('transfer_read')
+@timed('transfer_read')
+@device_event
+def handle_transfer_read(data):
+    """Serve one download chunk at ``offset``; an empty ``data`` with ``wait`` means back off."""
+    offset = data.get('offset', 0)
+    try:
+        transfer, chunk, wait = transfers.read(data.get('transfer_id'), offset)
+    except TransferError as e:
+        return transfer_error(e)
+    mark_alive(transfer.phone_id)
+    if wait:
+        return {'offset': offset, 'data': b'', 'wait': wait}
+    transfer_bytes.labels('download').inc(len(chunk))
+    done = offset + len(chunk) == transfer.size
+    report_transfer(transfer)
+    if done:
+        finish_transfer(transfer)
+    return {'offset': offset, 'data': chunk, 'crc32': zlib.crc32(chunk), 'done': done, 'wait': 0}
 
 port = int(os.environ.get('PORT', 5000))
 
+def raise_fd_limit():
+    """Lift the open-file soft limit to the hard limit; every device socket is an fd."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            return soft
+        return hard
+    return soft
+
 if __name__ == '__main__':
-    print("🚀 Starting Neon Control Server...")
-    print("📍 Web Panel: http://localhost:5000")
-    print("🎮 Modern Dark UI Activated")
-    print("📡 USSD System Ready")
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
+    fd_limit = raise_fd_limit()
+    log.info('server_starting', url=f"http://localhost:{port}", async_mode=socketio.async_mode,
+             fd_limit=fd_limit, worker=WORKER_ID)
+    if socketio.async_mode == 'threading':
+        socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
+    else:
+        socketio.run(app, host='0.0.0.0', port=port, debug=False)
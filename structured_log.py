@@ -0,0 +1,129 @@
+"""Non-blocking structured logging.
+
+``log(event, **fields)`` never touches stdout: it checks the event's level
+and sampling rate, then appends a tuple to a bounded deque. A native writer
+thread drains the deque every ``flush_interval`` seconds and writes the whole
+batch as JSON lines with a single write. When the deque is full the oldest
+records are dropped and counted, so a reconnect storm costs handlers an
+append, never a blocked write.
+
+Levels and sampling are per event type:
+
+    LOG_LEVEL=info
+    LOG_LEVELS=socket_connected=debug,phone_connected=info
+    LOG_SAMPLE=socket_connected=100      # keep 1 in 100
+
+``LOG_FORMAT=text`` writes ``key=value`` lines instead of JSON.
+"""
+import atexit
+import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+from native_thread import sleep, start_thread
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 0.1))
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, setting = item.partition('=')
+        pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class StructuredLogger:
+
+    def __init__(self, stream=None, level=LOG_LEVEL, event_levels=None, sample=None,
+                 queue_size=QUEUE_SIZE, flush_interval=FLUSH_INTERVAL, fmt=LOG_FORMAT):
+        """``event_levels`` maps event names to level names and ``sample``
+        maps event names to N (log one in N)."""
+        self.stream = stream or sys.stdout
+        self.threshold = LEVELS[level]
+        self.event_levels = {name: value for name, value in (event_levels or {}).items() if value in LEVELS}
+        self.sample = {name: int(value) for name, value in (sample or {}).items() if int(value) > 1}
+        self.flush_interval = flush_interval
+        self.fmt = fmt
+        self._queue = deque(maxlen=queue_size)
+        self._seen = {}
+        self.dropped = 0
+        self.written = 0
+        start_thread(self._run, ())
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls, event_levels=None, sample=None):
+        """Build a logger from ``LOG_*`` variables layered over the given defaults."""
+        event_levels = dict(event_levels or {})
+        event_levels.update(_parse_pairs(os.environ.get('LOG_LEVELS', '')))
+        sample = dict(sample or {})
+        sample.update(_parse_pairs(os.environ.get('LOG_SAMPLE', '')))
+        return cls(event_levels=event_levels, sample=sample)
+
+    def log(self, event, level='info', **fields):
+        level = self.event_levels.get(event, level)
+        if LEVELS[level] < self.threshold:
+            return
+        every = self.sample.get(event)
+        if every:
+            seen = self._seen.get(event, 0) + 1
+            self._seen[event] = seen
+            if seen % every != 1:
+                return
+            fields['sample'] = every
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append((time.time(), level, event, fields))
+
+    def debug(self, event, **fields):
+        self.log(event, 'debug', **fields)
+
+    def info(self, event, **fields):
+        self.log(event, 'info', **fields)
+
+    def warning(self, event, **fields):
+        self.log(event, 'warning', **fields)
+
+    def error(self, event, **fields):
+        self.log(event, 'error', **fields)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        self._drain()
+
+    def _run(self):
+        while True:
+            sleep(self.flush_interval)
+            try:
+                self._drain()
+            except Exception:
+                pass
+
+    def _drain(self):
+        lines = []
+        while self._queue:
+            try:
+                ts, level, event, fields = self._queue.popleft()
+            except IndexError:
+                break
+            lines.append(self._format(ts, level, event, fields))
+        if lines:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+            self.written += len(lines)
+
+    def _format(self, ts, level, event, fields):
+        timestamp = datetime.fromtimestamp(ts).isoformat(timespec='milliseconds')
+        if self.fmt == 'text':
+            extra = ' '.join(f"{key}={value}" for key, value in fields.items())
+            return f"{timestamp} {level.upper():7s} {event} {extra}\n"
+        return json.dumps({'ts': timestamp, 'level': level, 'event': event, **fields},
+                          separators=(',', ':'), default=str) + '\n'
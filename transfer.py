@@ -0,0 +1,380 @@
+"""Resumable file transfers between devices and the server.
+
+Files move in fixed ``chunk_size`` pieces carried as Socket.IO binary
+attachments, outside the ``message_response`` text path:
+
+- uploads (device -> server): the device sends ``transfer_chunk`` events
+  ``{transfer_id, offset, data, crc32}`` in order; each chunk is checked and
+  written at its offset straight into ``<dir>/<transfer_id>.bin``,
+- downloads (server -> device): the file is already on disk and the device
+  pulls it with ``transfer_read`` ``{transfer_id, offset}``.
+
+``chunk_size`` has to stay below Engine.IO's ``max_http_buffer_size``
+(1 MB by default), since each chunk travels as one packet.
+
+Either side resumes by offset. ``start`` on a known transfer reports how
+many bytes the server holds; transfers left over from a previous run are
+picked up from their ``<transfer_id>.json`` metadata, so an upload survives
+a server restart too. A whole-file ``sha256`` given when the transfer is
+created is checked once the last byte is in.
+
+At most ``max_active`` transfers run at once (``TransferLimit`` beyond
+that), and all of them share a ``max_rate`` bytes/second budget: a chunk
+offered while the budget is in debt is refused with ``wait`` seconds to back
+off, so bulk data can't crowd out command traffic on the same worker.
+
+A finished transfer is ``announce``-d once, however often the device
+retries its last chunk, and its files are deleted ``keep_finished`` seconds
+after it ended (long enough to fetch an upload from the API).
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import zlib
+from threading import Lock
+
+TRANSFER_DIR = os.environ.get('TRANSFER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'data', 'transfers'))
+CHUNK_SIZE = int(os.environ.get('TRANSFER_CHUNK_SIZE', 256 * 1024))
+MAX_ACTIVE = int(os.environ.get('TRANSFER_MAX_ACTIVE', 4))
+MAX_RATE = int(os.environ.get('TRANSFER_MAX_BYTES_PER_SEC', 4 * 1024 * 1024))
+IDLE_TIMEOUT = float(os.environ.get('TRANSFER_IDLE_TIMEOUT', 300))
+KEEP_FINISHED = float(os.environ.get('TRANSFER_KEEP_FINISHED', 3600))
+
+_TRANSFER_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class TransferError(Exception):
+    """A request that doesn't fit the transfer's state; the message is for the device."""
+
+
+class TransferLimit(TransferError):
+
+    def __init__(self, retry_after):
+        super().__init__('too many active transfers')
+        self.retry_after = retry_after
+
+
+class Transfer:
+    __slots__ = ('transfer_id', 'direction', 'phone_id', 'name', 'size', 'sha256', 'chunk_size',
+                 'received', 'status', 'created_at', 'finished_at', 'announced', 'last_activity',
+                 'reported_at', 'hasher', 'lock')
+
+    def __init__(self, transfer_id, direction, phone_id, name, size, sha256, chunk_size,
+                 received=0, status='active', created_at=None, finished_at=None, announced=False):
+        self.transfer_id = transfer_id
+        self.direction = direction
+        self.phone_id = phone_id
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.chunk_size = chunk_size
+        self.received = received
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.finished_at = finished_at
+        self.announced = announced
+        self.last_activity = time.monotonic()
+        self.reported_at = 0
+        self.hasher = None
+        self.lock = Lock()
+
+    @property
+    def finished(self):
+        return self.status in ('complete', 'failed')
+
+    def to_dict(self):
+        return {
+            'transfer_id': self.transfer_id,
+            'direction': self.direction,
+            'phone_id': self.phone_id,
+            'name': self.name,
+            'size': self.size,
+            'sha256': self.sha256,
+            'chunk_size': self.chunk_size,
+            'received': self.received,
+            'status': self.status,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'announced': self.announced
+        }
+
+
+class TransferManager:
+
+    def __init__(self, directory=TRANSFER_DIR, chunk_size=CHUNK_SIZE, max_active=MAX_ACTIVE,
+                 max_rate=MAX_RATE, idle_timeout=IDLE_TIMEOUT, keep_finished=KEEP_FINISHED):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_active = max_active
+        self.max_rate = max_rate
+        self.idle_timeout = idle_timeout
+        self.keep_finished = keep_finished
+        self._transfers = {}
+        self._lock = Lock()
+        # Token bucket shared by every transfer; it may go negative (debt).
+        self._tokens = float(max_rate)
+        self._refilled = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._delete_finished()
+
+    def path(self, transfer_id):
+        return os.path.join(self.directory, transfer_id + '.bin')
+
+    def create_upload(self, phone_id, name, size=None, sha256=None):
+        """Register a file the device is about to send."""
+        return self._create('upload', phone_id, name, size, sha256)
+
+    def create_download(self, phone_id, name, stream):
+        """Copy ``stream`` to disk in chunks and register it for the device to pull."""
+        transfer = self._create('download', phone_id, name, None, None)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(self.path(transfer.transfer_id), 'wb') as f:
+                while True:
+                    block = stream.read(self.chunk_size)
+                    if not block:
+                        break
+                    f.write(block)
+                    hasher.update(block)
+                    size += len(block)
+        except Exception:
+            self.delete(transfer.transfer_id)
+            raise
+        transfer.size = size
+        transfer.sha256 = hasher.hexdigest()
+        transfer.last_activity = time.monotonic()
+        self._save(transfer)
+        return transfer
+
+    def start(self, transfer_id, size=None, sha256=None):
+        """Resume a known transfer; an upload may fill in ``size``/``sha256`` here."""
+        transfer = self._get(transfer_id)
+        with transfer.lock:
+            if transfer.direction == 'upload' and transfer.received == 0:
+                transfer.size = transfer.size if size is None else int(size)
+                transfer.sha256 = transfer.sha256 or sha256
+                self._save(transfer)
+            transfer.last_activity = time.monotonic()
+        return transfer
+
+    def write(self, transfer_id, offset, data, crc32):
+        """Store one upload chunk; returns ``(transfer, written, wait)``.
+
+        A chunk at an offset already stored is acknowledged without being
+        written again (``written`` is 0); ``wait`` > 0 means the chunk was
+        refused for now.
+        """
+        transfer = self._get(transfer_id)
+        with transfer.lock:
+            if transfer.direction != 'upload':
+                raise TransferError('not an upload')
+            if offset < transfer.received or transfer.finished:
+                return transfer, 0, 0
+            if transfer.size is None:
+                raise TransferError('size is unknown; send transfer_start first')
+            if offset > transfer.received:
+                raise TransferError(f'expected offset {transfer.received}')
+            if len(data) > transfer.chunk_size:
+                raise TransferError(f'chunks are at most {transfer.chunk_size} bytes')
+            if offset + len(data) > transfer.size:
+                raise TransferError('chunk runs past the end of the file')
+            if zlib.crc32(data) != crc32:
+                raise TransferError('crc32 mismatch')
+            wait = self._admit(len(data))
+            if wait:
+                return transfer, 0, wait
+            with open(self.path(transfer_id), 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.write(data)
+            transfer.received += len(data)
+            if transfer.hasher is None:
+                transfer.hasher = self._hash_file(transfer_id, transfer.received)
+            else:
+                transfer.hasher.update(data)
+            transfer.last_activity = time.monotonic()
+            if transfer.received == transfer.size:
+                self._finish(transfer)
+            return transfer, len(data), 0
+
+    def read(self, transfer_id, offset):
+        """Read one download chunk; returns ``(transfer, data, wait)``."""
+        transfer = self._get(transfer_id)
+        if transfer.direction != 'download':
+            raise TransferError('not a download')
+        if not 0 <= offset <= transfer.size:
+            raise TransferError('offset out of range')
+        length = min(transfer.chunk_size, transfer.size - offset)
+        wait = self._admit(length)
+        if wait:
+            return transfer, None, wait
+        try:
+            with open(self.path(transfer_id), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        except FileNotFoundError:
+            # Finished long enough ago to have been deleted.
+            raise TransferError('unknown transfer')
+        with transfer.lock:
+            transfer.received = max(transfer.received, offset + len(data))
+            transfer.last_activity = time.monotonic()
+            if transfer.received == transfer.size and not transfer.finished:
+                transfer.status = 'complete'
+                transfer.finished_at = time.time()
+                self._save(transfer)
+        return transfer, data, 0
+
+    def announce(self, transfer):
+        """True only the first time it's called for a finished ``transfer``."""
+        with transfer.lock:
+            if not transfer.finished or transfer.announced:
+                return False
+            transfer.announced = True
+            self._save(transfer)
+            return True
+
+    def get(self, transfer_id):
+        try:
+            return self._get(transfer_id)
+        except TransferError:
+            return None
+
+    def delete(self, transfer_id):
+        transfer = self.get(transfer_id)
+        if transfer is None:
+            return False
+        with self._lock:
+            self._transfers.pop(transfer_id, None)
+        self._remove_files(transfer_id)
+        return True
+
+    def _remove_files(self, transfer_id):
+        for suffix in ('.bin', '.json'):
+            try:
+                os.remove(os.path.join(self.directory, transfer_id + suffix))
+            except FileNotFoundError:
+                pass
+
+    def active(self):
+        return [t for t in list(self._transfers.values()) if not t.finished]
+
+    def _create(self, direction, phone_id, name, size, sha256):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if len(self.active()) >= self.max_active:
+                raise TransferLimit(self._retry_after(now))
+            transfer = Transfer(uuid.uuid4().hex, direction, phone_id, os.path.basename(name or '') or 'file',
+                                None if size is None else int(size), sha256, self.chunk_size)
+            self._transfers[transfer.transfer_id] = transfer
+        self._save(transfer)
+        return transfer
+
+    def _get(self, transfer_id):
+        if not isinstance(transfer_id, str) or not _TRANSFER_ID.match(transfer_id):
+            raise TransferError('unknown transfer')
+        transfer = self._transfers.get(transfer_id)
+        if transfer is not None:
+            return transfer
+        try:
+            with open(os.path.join(self.directory, transfer_id + '.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise TransferError('unknown transfer')
+        transfer = Transfer(**meta)
+        if transfer.direction == 'upload' and not transfer.finished:
+            # Only whole chunks count; a write cut short by a crash is redone.
+            try:
+                stored = os.path.getsize(self.path(transfer_id))
+            except OSError:
+                stored = 0
+            transfer.received = stored - stored % transfer.chunk_size
+            if stored == transfer.size:
+                # Everything arrived but the process died before it was checked.
+                transfer.received = stored
+                transfer.hasher = self._hash_file(transfer_id, stored)
+                self._finish(transfer)
+        with self._lock:
+            return self._transfers.setdefault(transfer_id, transfer)
+
+    def _hash_file(self, transfer_id, length):
+        """Hash the first ``length`` bytes on disk (once per upload or resume)."""
+        hasher = hashlib.sha256()
+        remaining = length
+        with open(self.path(transfer_id), 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(self.chunk_size, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+        return hasher
+
+    def _finish(self, transfer):
+        transfer.size = transfer.received
+        if transfer.sha256 and transfer.hasher.hexdigest() != transfer.sha256.lower():
+            transfer.status = 'failed'
+        else:
+            transfer.sha256 = transfer.hasher.hexdigest()
+            transfer.status = 'complete'
+        transfer.finished_at = time.time()
+        transfer.hasher = None
+        self._save(transfer)
+
+    def _save(self, transfer):
+        meta = transfer.to_dict()
+        path = os.path.join(self.directory, transfer.transfer_id + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def _admit(self, size):
+        """Charge ``size`` bytes to the shared budget, or return seconds to wait."""
+        if not self.max_rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.max_rate), self._tokens + (now - self._refilled) * self.max_rate)
+            self._refilled = now
+            if self._tokens < 0:
+                return round(-self._tokens / self.max_rate, 3)
+            self._tokens -= size
+            return 0
+
+    def _retry_after(self, now):
+        oldest = min((t.last_activity for t in self.active()), default=now)
+        return max(1, int(oldest + self.idle_timeout - now) + 1)
+
+    def _expire(self, now):
+        """Forget idle transfers; an unfinished one's files stay on disk so it can resume."""
+        cutoff = now - self.idle_timeout
+        for transfer_id, transfer in list(self._transfers.items()):
+            if transfer.last_activity < cutoff:
+                del self._transfers[transfer_id]
+        self._delete_finished()
+
+    def _delete_finished(self):
+        """Delete every transfer that finished more than ``keep_finished`` seconds ago.
+
+        Reads the metadata on disk, so it also clears out earlier runs.
+        """
+        cutoff = time.time() - self.keep_finished
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if meta.get('status') in ('complete', 'failed') and (meta.get('finished_at') or 0) < cutoff:
+                transfer_id = name[:-len('.json')]
+                self._transfers.pop(transfer_id, None)
+                self._remove_files(transfer_id)
+
+    def __len__(self):
+        return len(self.active())
@@ -0,0 +1,390 @@
+"""USSD session bookkeeping.
+
+Sessions get collision-free ids and two deadlines: an idle timeout that is
+pushed back by every request/update, and an absolute limit from the start.
+Deadlines live in a min-heap with lazy invalidation, so ``touch`` and
+``reap`` are O(log n) and reaping never scans live sessions. A per-phone
+index lets a disconnecting device drop its sessions at once.
+
+Campaigns run the same code and scripted menu path on many phones, up to a
+concurrency limit, and collect each phone's final screen.
+
+Menu screens are parsed into a prompt plus numbered options and cached per
+(ussd_code, path), so clients can read a menu tree without a live session
+and repeated screens can be sent as a short reference.
+"""
+import hashlib
+import heapq
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from threading import Lock
+
+IDLE_TIMEOUT = float(os.environ.get('USSD_IDLE_TIMEOUT', 60))
+MAX_DURATION = float(os.environ.get('USSD_MAX_DURATION', 300))
+REAP_INTERVAL = float(os.environ.get('USSD_REAP_INTERVAL', 1))
+CAMPAIGN_HISTORY = int(os.environ.get('USSD_CAMPAIGN_HISTORY', 100))
+MENU_CACHE_SIZE = int(os.environ.get('USSD_MENU_CACHE_SIZE', 5000))
+
+# "1. Balance", "2) Data", "3: Offers" at line start or inline after whitespace.
+MENU_OPTION = re.compile(r'(?:^|(?<=\s))(\d{1,2}|[*#])\s*[.):-]\s*([^\d\s].*?)(?=\s+(?:\d{1,2}|[*#])\s*[.):-]\s*[^\d\s]|\n|$)', re.M)
+
+
+class UssdSession:
+    __slots__ = ('session_id', 'phone_id', 'ussd_code', 'sid', 'started_at', 'last_activity', 'deadline', 'path')
+
+    def __init__(self, session_id, phone_id, ussd_code, sid, now):
+        self.session_id = session_id
+        self.phone_id = phone_id
+        self.ussd_code = ussd_code
+        self.sid = sid
+        self.started_at = now
+        self.last_activity = now
+        self.deadline = None
+        self.path = []
+
+
+class UssdSessionManager:
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, max_duration=MAX_DURATION):
+        self.idle_timeout = idle_timeout
+        self.max_duration = max_duration
+        self._sessions = {}
+        self._by_phone = {}
+        self._deadlines = []
+        self._lock = Lock()
+        self.expired = 0
+
+    def start(self, phone_id, ussd_code, sid):
+        now = time.monotonic()
+        session = UssdSession(f"ussd_{phone_id}_{uuid.uuid4().hex[:12]}", phone_id, ussd_code, sid, now)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._by_phone.setdefault(phone_id, set()).add(session.session_id)
+            self._schedule(session)
+        return session
+
+    def touch(self, session_id):
+        """Record activity on a session; returns it, or ``None`` if it is gone."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_activity = time.monotonic()
+                self._schedule(session)
+            return session
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def end(self, session_id):
+        with self._lock:
+            return self._remove(session_id)
+
+    def end_phone(self, phone_id):
+        """End every session of ``phone_id`` and return them."""
+        with self._lock:
+            return [self._remove(sid) for sid in list(self._by_phone.get(phone_id, ()))]
+
+    def reap(self, now=None):
+        """Remove and return sessions past their idle or absolute deadline."""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, session_id = heapq.heappop(self._deadlines)
+                session = self._sessions.get(session_id)
+                # Entries superseded by a later touch are skipped here.
+                if session is not None and session.deadline == deadline:
+                    expired.append(self._remove(session_id))
+            self.expired += len(expired)
+        return expired
+
+    def _schedule(self, session):
+        session.deadline = min(session.last_activity + self.idle_timeout,
+                               session.started_at + self.max_duration)
+        heapq.heappush(self._deadlines, (session.deadline, session.session_id))
+        # Touches leave stale heap entries behind; rebuild when they dominate.
+        if len(self._deadlines) > 4 * len(self._sessions) + 64:
+            self._deadlines = [(s.deadline, s.session_id) for s in self._sessions.values()]
+            heapq.heapify(self._deadlines)
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            phone_sessions = self._by_phone.get(session.phone_id)
+            if phone_sessions is not None:
+                phone_sessions.discard(session_id)
+                if not phone_sessions:
+                    del self._by_phone[session.phone_id]
+        return session
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class CampaignRun:
+    __slots__ = ('phone_id', 'session_id', 'step', 'started_at', 'transcript')
+
+    def __init__(self, phone_id, session_id):
+        self.phone_id = phone_id
+        self.session_id = session_id
+        self.step = 0
+        self.started_at = time.monotonic()
+        self.transcript = []
+
+
+class UssdCampaign:
+    """One USSD code plus menu path run across many phones."""
+
+    def __init__(self, campaign_id, ussd_code, menu_path, phone_ids, concurrency):
+        self.campaign_id = campaign_id
+        self.ussd_code = ussd_code
+        self.menu_path = list(menu_path)
+        self.concurrency = max(1, concurrency)
+        self.total = len(phone_ids)
+        self.pending = deque(phone_ids)
+        self.running = {}
+        self.results = []
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return not self.pending and not self.running
+
+    def to_dict(self, include_results=True):
+        elapsed = (self.finished_at or time.monotonic()) - self.created_at
+        durations = sorted(r['duration_ms'] for r in self.results if r['duration_ms'] is not None)
+        statuses = {}
+        for result in self.results:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+        def pct(p):
+            return durations[min(len(durations) - 1, int(p / 100 * len(durations)))] if durations else None
+
+        summary = {
+            'campaign_id': self.campaign_id,
+            'ussd_code': self.ussd_code,
+            'menu_path': self.menu_path,
+            'state': 'finished' if self.done else 'running',
+            'total': self.total,
+            'pending': len(self.pending),
+            'running': len(self.running),
+            'finished': len(self.results),
+            'statuses': statuses,
+            'elapsed_s': round(elapsed, 3),
+            'sessions_per_s': round(len(self.results) / elapsed, 2) if elapsed else None,
+            'duration_ms': {'p50': pct(50), 'p95': pct(95), 'max': durations[-1] if durations else None}
+        }
+        if include_results:
+            summary['results'] = list(self.results)
+        return summary
+
+
+class CampaignManager:
+    """Runs USSD campaigns on top of ordinary sessions.
+
+    The manager only decides what happens next; the caller owns the
+    Socket.IO side. ``start_next`` calls ``create_session(phone_id,
+    ussd_code)`` (returning a ``UssdSession`` or ``None``) for as many phones
+    as the campaign's concurrency allows and returns the new sessions, which
+    the caller then sends to the devices.
+    """
+
+    def __init__(self, history=CAMPAIGN_HISTORY):
+        self.history = history
+        self._campaigns = {}
+        self._by_session = {}
+        self._lock = Lock()
+
+    def create(self, ussd_code, menu_path, phone_ids, concurrency, unsupported=()):
+        """``unsupported`` phones count towards the total but are reported without being run."""
+        campaign = UssdCampaign(f"campaign_{uuid.uuid4().hex[:12]}", ussd_code, menu_path, phone_ids, concurrency)
+        campaign.total += len(unsupported)
+        campaign.results.extend(self._result(phone_id, 'unsupported', None, []) for phone_id in unsupported)
+        with self._lock:
+            self._campaigns[campaign.campaign_id] = campaign
+            finished = [c for c in self._campaigns.values() if c.done]
+            for old in finished[:max(0, len(finished) - self.history)]:
+                del self._campaigns[old.campaign_id]
+        return campaign
+
+    def get(self, campaign_id):
+        return self._campaigns.get(campaign_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._campaigns.values())
+
+    def is_campaign_session(self, session_id):
+        return session_id in self._by_session
+
+    def start_next(self, campaign, create_session):
+        started = []
+        with self._lock:
+            while campaign.pending and len(campaign.running) < campaign.concurrency:
+                phone_id = campaign.pending.popleft()
+                session = create_session(phone_id, campaign.ussd_code)
+                if session is None:
+                    campaign.results.append(self._result(phone_id, 'phone not found', None, []))
+                    continue
+                campaign.running[session.session_id] = CampaignRun(phone_id, session.session_id)
+                self._by_session[session.session_id] = campaign
+                started.append(session)
+            self._check_finished(campaign)
+        return started
+
+    def on_update(self, session_id, response):
+        """Record a menu screen for a campaign session.
+
+        Returns ``(True, next_input)`` for campaign sessions, where
+        ``next_input`` is ``None`` once the menu path is exhausted and the
+        screen was the final one, and ``(False, None)`` for other sessions.
+        """
+        with self._lock:
+            campaign = self._by_session.get(session_id)
+            run = campaign.running.get(session_id) if campaign else None
+            if run is None:
+                return False, None
+            run.transcript.append(response)
+            if run.step < len(campaign.menu_path):
+                run.step += 1
+                return True, campaign.menu_path[run.step - 1]
+            return True, None
+
+    def on_end(self, session_id, status):
+        """Finish a campaign session; returns its campaign so the caller can refill it."""
+        with self._lock:
+            campaign = self._by_session.pop(session_id, None)
+            if campaign is None:
+                return None
+            run = campaign.running.pop(session_id, None)
+            if run is not None:
+                if status == 'completed' and run.step < len(campaign.menu_path):
+                    status = 'incomplete'
+                campaign.results.append(self._result(
+                    run.phone_id, status, (time.monotonic() - run.started_at) * 1000, run.transcript))
+            self._check_finished(campaign)
+            return campaign
+
+    @staticmethod
+    def _result(phone_id, status, duration_ms, transcript):
+        return {
+            'phone_id': phone_id,
+            'status': status,
+            'final_text': transcript[-1] if transcript else None,
+            'duration_ms': round(duration_ms, 1) if duration_ms is not None else None,
+            'transcript': transcript
+        }
+
+    @staticmethod
+    def _check_finished(campaign):
+        if campaign.done and campaign.finished_at is None:
+            campaign.finished_at = time.monotonic()
+
+
+def parse_menu(text):
+    """Split a USSD screen into its prompt and numbered options."""
+    text = (text or '').strip()
+    match = MENU_OPTION.search(text)
+    if match is None:
+        return {'prompt': text, 'options': []}
+    options = [{'key': key, 'label': label.strip()} for key, label in MENU_OPTION.findall(text)]
+    return {'prompt': text[:match.start()].strip(), 'options': options}
+
+
+class MenuNode:
+    __slots__ = ('ussd_code', 'path', 'ref', 'text', 'prompt', 'options', 'hits', 'updated_at')
+
+    def __init__(self, ussd_code, path, text):
+        self.ussd_code = ussd_code
+        self.path = path
+        self.hits = 0
+        self.update(text)
+
+    def update(self, text):
+        menu = parse_menu(text)
+        self.text = text
+        self.ref = hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest()[:16]
+        self.prompt = menu['prompt']
+        self.options = menu['options']
+        self.updated_at = time.time()
+
+    def to_dict(self, include_text=True):
+        node = {
+            'ussd_code': self.ussd_code,
+            'path': list(self.path),
+            'ref': self.ref,
+            'prompt': self.prompt,
+            'options': self.options,
+            'hits': self.hits,
+            'updated_at': self.updated_at
+        }
+        if include_text:
+            node['text'] = self.text
+        return node
+
+
+class MenuCache:
+    """LRU of parsed menus keyed by ``(ussd_code, path)``."""
+
+    def __init__(self, size=MENU_CACHE_SIZE):
+        self.size = size
+        self._nodes = OrderedDict()
+        self._by_ref = {}
+        self._lock = Lock()
+
+    def observe(self, ussd_code, path, text):
+        """Record a screen; returns ``(node, unchanged)``."""
+        key = (ussd_code, tuple(path))
+        with self._lock:
+            node = self._nodes.get(key)
+            if node is not None and node.text == text:
+                node.hits += 1
+                self._nodes.move_to_end(key)
+                return node, True
+            if node is None:
+                node = self._nodes[key] = MenuNode(ussd_code, key[1], text)
+            else:
+                self._drop_ref(node)
+                node.update(text)
+                self._nodes.move_to_end(key)
+            self._by_ref.setdefault(node.ref, set()).add(key)
+            while len(self._nodes) > self.size:
+                _, old = self._nodes.popitem(last=False)
+                self._drop_ref(old)
+            return node, False
+
+    def get(self, ussd_code, path):
+        return self._nodes.get((ussd_code, tuple(path)))
+
+    def get_ref(self, ref):
+        with self._lock:
+            keys = self._by_ref.get(ref)
+            return self._nodes.get(next(iter(keys))) if keys else None
+
+    def tree(self, ussd_code):
+        """Every cached menu of ``ussd_code`` nested by the input that leads to it."""
+        with self._lock:
+            nodes = sorted((n for (code, _), n in self._nodes.items() if code == ussd_code),
+                           key=lambda n: len(n.path))
+        root = {'ussd_code': ussd_code, 'menu': None, 'children': {}}
+        for node in nodes:
+            branch = root
+            for step in node.path:
+                branch = branch['children'].setdefault(step, {'menu': None, 'children': {}})
+            branch['menu'] = node.to_dict(include_text=False)
+        return root
+
+    def _drop_ref(self, node):
+        keys = self._by_ref.get(node.ref)
+        if keys is not None:
+            keys.discard((node.ussd_code, node.path))
+            if not keys:
+                del self._by_ref[node.ref]
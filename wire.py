@@ -0,0 +1,104 @@
+"""Compact wire encoding for device traffic.
+
+Devices on metered mobile data can ask for ``msgpack`` when they register
+(``'encodings': ['msgpack', 'json']``). Their events are then exchanged as
+a single binary Socket.IO argument holding a msgpack map with one-letter
+keys:
+
+- correlation ids travel as 16 raw bytes instead of 32 hex characters,
+- timestamps are integer epoch milliseconds instead of ISO strings,
+- text fields of at least ``compress_min`` bytes are zlib-compressed and
+  their keys listed under ``z``.
+
+``decode`` restores the long keys, so handlers see the same dicts as from
+JSON devices. Devices that don't offer msgpack, or servers without the
+``msgpack`` package, stay on plain JSON.
+"""
+import os
+import zlib
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESS_MIN = int(os.environ.get('WIRE_COMPRESS_MIN', 1024))
+
+SHORT_KEYS = {
+    'action': 'a',
+    'command': 'c',
+    'device_id': 'd',
+    'done': 'e',
+    'offset': 'f',
+    'tags': 'g',
+    'correlation_id': 'i',
+    'crc32': 'k',
+    'message': 'm',
+    'message_id': 'n',
+    'data': 'o',
+    'phone_id': 'p',
+    'seq': 'q',
+    'response': 'r',
+    'session_id': 's',
+    'timestamp': 't',
+    'ussd_code': 'u',
+    'stream': 'w',
+    'transfer_id': 'x',
+    'type': 'y',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+COMPRESSED = 'z'
+
+
+def supported():
+    return ['msgpack', 'json'] if msgpack is not None else ['json']
+
+
+def negotiate(offered):
+    """Pick the first encoding from the device's ``offered`` list that we speak."""
+    available = supported()
+    for encoding in offered or ():
+        if encoding in available:
+            return encoding
+    return 'json'
+
+
+def _epoch_ms(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return int(value * 1000)
+
+
+def encode(payload, compress_min=COMPRESS_MIN):
+    packed = {}
+    compressed = []
+    for key, value in payload.items():
+        short = SHORT_KEYS.get(key, key)
+        if key == 'correlation_id' and isinstance(value, str) and len(value) == 32:
+            value = bytes.fromhex(value)
+        elif key == 'timestamp' and value is not None:
+            value = _epoch_ms(value)
+        elif isinstance(value, str) and len(value) >= compress_min:
+            value = zlib.compress(value.encode('utf-8'))
+            compressed.append(short)
+        packed[short] = value
+    if compressed:
+        packed[COMPRESSED] = compressed
+    return msgpack.packb(packed, use_bin_type=True)
+
+
+def decode(data):
+    packed = msgpack.unpackb(data, raw=False)
+    compressed = packed.pop(COMPRESSED, ())
+    payload = {}
+    for short, value in packed.items():
+        key = LONG_KEYS.get(short, short)
+        if short in compressed:
+            value = zlib.decompress(value).decode('utf-8', 'replace')
+        elif key == 'correlation_id' and isinstance(value, bytes):
+            value = value.hex()
+        payload[key] = value
+    return payload